@@ -0,0 +1,29 @@
+"""Module for recognising keywords that contain banned words, e.g. to exclude them from graphs."""
+import re
+from typing import Iterable
+import numpy as np
+from numpy import ndarray
+
+BANNED_WORDS_FILEPATH = "./swearWords.txt"
+
+
+def load_banned_words(file_path: str = BANNED_WORDS_FILEPATH) -> list[str]:
+    """Load the list of banned words, one per line"""
+    with open(file_path) as swears:
+        return [word.strip() for word in swears.readlines() if word.strip()]
+
+
+def compile_matcher(words: Iterable[str]) -> re.Pattern:
+    """Compile one case insensitive pattern finding any of the words in a string"""
+    words = sorted(words, key=len, reverse=True)
+    if not words:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(re.escape(word) for word in words), re.IGNORECASE)
+
+
+BANNED_PATTERN = compile_matcher(load_banned_words())
+
+
+def contains_banned_word(keywords: Iterable[str], pattern: re.Pattern = BANNED_PATTERN) -> ndarray:
+    """Return whether each keyword contains a banned word"""
+    return np.array([pattern.search(keyword) is not None for keyword in keywords], dtype=bool)
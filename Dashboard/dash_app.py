@@ -2,10 +2,10 @@
 import dash_bootstrap_components as dbc
 from dash import Dash, page_container, html, callback, dcc, dash_table
 from dash.dependencies import Input, Output, State
-import pandas as pd
-from data import build_dataframe
+from data import date_range, titles_for_date
+from store import STORE
+from result_cache import memoize, normalise_keywords
 
-DATA = build_dataframe().drop('comment_keyword', axis=1).drop_duplicates()
 LOGO = 'https://i.ibb.co/G3gjvcb/Screenshot-2023-05-24-at-15-03-40.png'
 
 app = Dash(external_stylesheets=[dbc.themes.BOOTSTRAP], use_pages=True)
@@ -75,8 +75,7 @@ app.layout = dbc.Container(
                                         dbc.Row([
                                             dcc.DatePickerSingle(
                                                 id="bottom-datepicker",
-                                                min_date_allowed=min(
-                                                    DATA["comment_time"].dt.date),
+                                                min_date_allowed=date_range()[0],
                                                 clearable=False,
                                             ),
                                         ],
@@ -108,24 +107,16 @@ app.layout = dbc.Container(
     State('bottom-input', 'value'),
     State('bottom-datepicker', 'date'),
 )
+@memoize(key=lambda n_clicks, keywords, date: (normalise_keywords(keywords), date))
 def return_posts(n_clicks: int, keywords: str, date: str) -> list:
     """Return a list of post titles and their counts."""
     if keywords:
 
         # Split the keywords by comma
         keywords = [keyword.strip() for keyword in keywords.split(",")]
-        # Filter the data based on the keywords
-        filtered_data = DATA[DATA['post_keyword'].str.contains(
-            '|'.join(keywords), case=False)]
-        grouped_data = filtered_data.groupby(
-            [filtered_data['comment_time'].dt.date, filtered_data['title']])['comment'].count()
-        grouped_data = grouped_data.to_frame().reset_index(level=[0,1])
-        grouped_data['comment_time'] = pd.to_datetime(grouped_data['comment_time'])
-        filtered_data = grouped_data[(grouped_data['comment_time'] == date)]
-        filtered_data = filtered_data.groupby(
-            [filtered_data['title']])['comment'].sum()
-        filtered_data = filtered_data.to_frame().reset_index(level=[0])
-        filtered_data = filtered_data.sort_values(by='comment', ascending=False).rename(columns={"title": "Post Title", "comment": "Comment Count"})
+        # Count the comments on the matching posts on the date
+        filtered_data = titles_for_date(STORE.post_keywords.search_any(keywords), date).rename(
+            columns={"title": "Post Title", "comment": "Comment Count"})
         output = dash_table.DataTable(filtered_data.to_dict('records'),
                                       [{"name": i, "id": i} for i in filtered_data.columns],
                                       style_data={
@@ -140,4 +131,5 @@ def return_posts(n_clicks: int, keywords: str, date: str) -> list:
 
 
 if __name__ == "__main__":
+    STORE.start_refresh()
     app.run_server(host="0.0.0.0", port=8080)
@@ -1,12 +1,26 @@
 """Module for data extraction and loading into a Pandas dataframe used for visualisation."""
 import os
+from functools import cache
 import pandas as pd
 from pandas import DataFrame
-from sqlalchemy import URL, create_engine
+from sqlalchemy import URL, Engine, create_engine
 
+# Types of the columns of the dataframe kept in memory. Repeated strings are stored once as
+# categories, and ids and measures in 32 bits.
+COMPACT_DTYPES = {
+    'comment_id': 'int32',
+    'score': 'int32',
+    'sentiment': 'float32',
+    'post_id': 'int32',
+    'comment_keyword': 'category',
+    'post_keyword': 'category',
+    'title': 'category'
+}
 
-def build_dataframe() -> DataFrame:
-    """Build a dataframe based on the contents of a postgres database and returns them clean."""
+
+@cache
+def get_engine() -> Engine:
+    """Create the engine connecting to the postgres database, shared by every query."""
     url_object = URL.create(
         "postgresql+psycopg2",
         username=os.environ.get('USERNAME'),
@@ -14,17 +28,32 @@ def build_dataframe() -> DataFrame:
         host=os.environ.get('HOST'),
         database=os.environ.get('DATABASE')
     )
-    engine = create_engine(url_object)
-
-    post = pd.read_sql_table(table_name='post', con=engine)
-    post_keyword = pd.read_sql_table(table_name='post_keyword', con=engine)
-    keyword_in_post = pd.read_sql_table(
-        table_name='keyword_in_post', con=engine)
-    comment = pd.read_sql_table(table_name='comment', con=engine)
-    comment_keyword = pd.read_sql_table(
-        table_name='comment_keyword', con=engine)
-    keyword_in_comment = pd.read_sql_table(
-        table_name='keyword_in_comment', con=engine)
+    return create_engine(url_object)
+
+
+def read_table(table_name: str, columns: list = None, compact: bool = False) -> DataFrame:
+    """Read a table into a dataframe, with the compact types of its columns if compact."""
+    table = pd.read_sql_table(table_name=table_name, con=get_engine(), columns=columns)
+    if compact:
+        table = table.astype({column: dtype for column, dtype in COMPACT_DTYPES.items()
+                              if column in table.columns})
+    return table
+
+
+def build_dataframe(compact: bool = False) -> DataFrame:
+    """Build a dataframe based on the contents of a postgres database and returns them clean.
+    A compact dataframe leaves out the comment text and has the types of COMPACT_DTYPES,
+    applied to each table as it is read so the full size is never held in memory."""
+    comment_columns = ['comment_id', 'comment_time', 'comment', 'score', 'sentiment', 'post_id']
+    if compact:
+        comment_columns.remove('comment')
+
+    post = read_table('post', ['post_id', 'post_time', 'title'], compact)
+    post_keyword = read_table('post_keyword', ['post_keyword_id', 'post_keyword'], compact)
+    keyword_in_post = read_table('keyword_in_post')
+    comment = read_table('comment', comment_columns, compact)
+    comment_keyword = read_table('comment_keyword', compact=compact)
+    keyword_in_comment = read_table('keyword_in_comment')
 
     post_keywords = pd.merge(post_keyword, keyword_in_post, how='inner',
                              left_on='post_keyword_id',
@@ -38,4 +67,114 @@ def build_dataframe() -> DataFrame:
                                      left_on='comment_id',
                                     right_on='comment_id').drop('comment_keyword_id', axis=1)
 
-    return pd.merge(comments_and_keywords, posts_and_keywords, how='inner', on='post_id')
+    dataframe = pd.merge(comments_and_keywords, posts_and_keywords, how='inner', on='post_id')
+    if not compact:
+        return dataframe
+    # Leave out the keywords and titles of rows the joins dropped
+    for column in dataframe.select_dtypes('category').columns:
+        dataframe[column] = dataframe[column].cat.remove_unused_categories()
+    return compact_dataframe(dataframe)
+
+
+def build_new_rows(after_comment_id: int) -> DataFrame:
+    """Build the rows of the compact dataframe returned by build_dataframe for comments with
+    an id greater than the one given, joining the tables in the database."""
+    return pd.read_sql_query(
+        """SELECT c.comment_id, c.comment_time, c.score, c.sentiment, c.post_id,
+                  ck.comment_keyword, pk.post_keyword, p.post_time, p.title
+           FROM comment c
+           JOIN keyword_in_comment kc USING (comment_id)
+           JOIN comment_keyword ck USING (comment_keyword_id)
+           JOIN post p USING (post_id)
+           JOIN keyword_in_post kp USING (post_id)
+           JOIN post_keyword pk USING (post_keyword_id)
+           WHERE c.comment_id > %(after_comment_id)s""",
+        con=get_engine(), params={'after_comment_id': int(after_comment_id)},
+        parse_dates=['comment_time', 'post_time'])
+
+
+def compact_dataframe(dataframe: DataFrame) -> DataFrame:
+    """Return rows of the dataframe, without the comment text, with the types of COMPACT_DTYPES."""
+    return dataframe.astype(COMPACT_DTYPES)
+
+
+def comment_text(comment_ids: list[int]) -> DataFrame:
+    """Return the text of the given comments, which the compact dataframe leaves out."""
+    return query("SELECT comment_id, comment FROM comment WHERE comment_id = ANY(%(comment_ids)s)",
+                 comment_ids=[int(comment_id) for comment_id in comment_ids])
+
+
+def text_size() -> int:
+    """Return the bytes of text in the rows of the full dataframe, i.e. the comment text left
+    out of the compact dataframe and the keywords and titles it stores once. Summed in the
+    database, so the text is never read."""
+    return int(query(
+        """SELECT COALESCE(SUM(octet_length(c.comment) + octet_length(ck.comment_keyword)
+                               + octet_length(pk.post_keyword) + octet_length(p.title)), 0)
+                  AS size
+           FROM comment c
+           JOIN keyword_in_comment kc USING (comment_id)
+           JOIN comment_keyword ck USING (comment_keyword_id)
+           JOIN post p USING (post_id)
+           JOIN keyword_in_post kp USING (post_id)
+           JOIN post_keyword pk USING (post_keyword_id)""")['size'][0])
+
+
+def query(sql: str, parse_dates: list = None, **params) -> DataFrame:
+    """Run a parameterised query, returning its result as a dataframe."""
+    return pd.read_sql_query(sql, con=get_engine(), params=params, parse_dates=parse_dates)
+
+
+# The functions below aggregate in the database, so each callback only transfers the rows it
+# plots. Keywords are matched exactly; pages find the keywords matching a search in the store.
+
+def date_range() -> tuple:
+    """Return the dates of the first and last comments."""
+    dates = query("""SELECT MIN(day) AS first_day, MAX(day) AS last_day
+                     FROM keyword_sentiment_daily""")
+    return dates['first_day'][0], dates['last_day'][0]
+
+
+def sentiment_by_day(keywords: list[str], start_date: str, end_date: str) -> DataFrame:
+    """Return the mean sentiment per day of the comments on posts with any of the keywords,
+    between two dates inclusive."""
+    return query(
+        """SELECT d.day AS comment_time, SUM(d.sentiment_sum) / SUM(d.comment_count) AS sentiment
+           FROM keyword_sentiment_daily d
+           JOIN post_keyword k USING (post_keyword_id)
+           WHERE k.post_keyword = ANY(%(keywords)s)
+           AND d.day BETWEEN %(start_date)s AND %(end_date)s
+           GROUP BY d.day
+           ORDER BY d.day""",
+        parse_dates=['comment_time'], keywords=list(keywords),
+        start_date=start_date, end_date=end_date)
+
+
+def label_sentiment_by_day(label: str) -> DataFrame:
+    """Return the mean sentiment per day of the comments on posts with each of the keywords
+    labelled as a given kind of entity by the extract step, e.g. ORG for organisations."""
+    return query(
+        """SELECT d.day AS comment_time, k.post_keyword,
+                  d.sentiment_sum / d.comment_count AS sentiment
+           FROM keyword_sentiment_daily d
+           JOIN post_keyword k USING (post_keyword_id)
+           WHERE k.label = %(label)s""",
+        parse_dates=['comment_time'], label=label)
+
+
+def titles_for_date(keywords: list[str], date: str) -> DataFrame:
+    """Return the titles of the posts with any of the keywords that were commented on on a
+    date, with their number of comments, most commented first."""
+    # Read the day's rows of the post comment rollup, so the query only touches the posts
+    # commented on that day however much history is loaded
+    return query(
+        """SELECT p.title, SUM(d.comment_count)::int AS comment
+           FROM post_comment_daily d
+           JOIN post p USING (post_id)
+           JOIN keyword_in_post kp USING (post_id)
+           JOIN post_keyword k USING (post_keyword_id)
+           WHERE d.day = %(date)s::date
+           AND k.post_keyword = ANY(%(keywords)s)
+           GROUP BY p.title
+           ORDER BY comment DESC""",
+        keywords=list(keywords), date=date)
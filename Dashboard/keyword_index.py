@@ -0,0 +1,45 @@
+"""Module for searching keywords by substring without scanning every row of the data."""
+from collections import defaultdict
+from typing import Iterable
+
+# Length of the substrings indexed. Queries shorter than this check every keyword.
+NGRAM_LENGTH = 3
+
+
+def ngrams(text: str) -> set[str]:
+    """Return the substrings of NGRAM_LENGTH characters in a string"""
+    return {text[i:i + NGRAM_LENGTH] for i in range(len(text) - NGRAM_LENGTH + 1)}
+
+
+class KeywordIndex:
+    """Case insensitive substring search over a set of distinct keywords. Each keyword is
+    indexed by the trigrams it contains, so a search only checks the keywords containing
+    every trigram of the query, however many rows each keyword appears in."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = list(dict.fromkeys(keywords))
+        self.folded = [keyword.casefold() for keyword in self.keywords]
+        self.index = defaultdict(set)
+        for position, keyword in enumerate(self.folded):
+            for ngram in ngrams(keyword):
+                self.index[ngram].add(position)
+
+    def search(self, query: str) -> list[str]:
+        """Return the keywords containing the query, ignoring case. The query is matched
+        literally, and an empty query matches every keyword."""
+        query = query.casefold()
+        query_ngrams = ngrams(query)
+        if query_ngrams:
+            candidates = set.intersection(
+                *sorted((self.index.get(ngram, set()) for ngram in query_ngrams), key=len))
+        else:
+            candidates = range(len(self.keywords))
+        return [self.keywords[position] for position in sorted(candidates)
+                if query in self.folded[position]]
+
+    def search_any(self, queries: Iterable[str]) -> list[str]:
+        """Return the keywords containing any of the queries, ignoring case."""
+        matches = {}
+        for query in queries:
+            matches.update(dict.fromkeys(self.search(query)))
+        return list(matches)
@@ -3,117 +3,94 @@ import random
 from dash import register_page, dcc, html, callback
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
-from pandas import DataFrame
-from data import build_dataframe
-from datetime import datetime
+from data import date_range, sentiment_by_day
+from store import STORE
+from result_cache import memoize, normalise_keywords
 import plotly.express as px
-import pandas as pd
 import dash_loading_spinners as dls
 import plotly.graph_objects as go
 
-# Load the data
-data = build_dataframe().drop('comment_keyword', axis=1).drop_duplicates()
-
 
 # Register the page
 register_page(__name__, title="Home", path="/")
 random_selector = ["Apple", "OpenAI, ChatGPT"]
 
 
-def filter_data(keywords: str) -> DataFrame:
-    """Filter the dataframe based on the provided keywords"""
-    if keywords:
-        # Split the keywords by comma
-        keywords = [keyword.strip() for keyword in keywords.split(",")]
-        # Filter the data based on the keywords
-        filtered_data = data[data['post_keyword'].str.contains(
-            '|'.join(keywords), case=False)]
-
-    else:
-        # Return the original data if no keywords are provided
-        filtered_data = data
-    grouped_data = filtered_data.groupby(
-        [filtered_data['comment_time'].dt.date])['sentiment'].mean()
-    grouped_data = grouped_data.to_frame().reset_index(level=[0])
-    grouped_data['comment_time'] = pd.to_datetime(grouped_data['comment_time'])
-    return grouped_data
-
-
-layout = html.Div(
-    [
-        dbc.Card(
-            dbc.CardBody(
-                [
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                [
-                                    dbc.Input(
-                                        id='input',
-                                        type='text',
-                                        placeholder='Enter keywords (comma-separated)',
-                                        value=random.choice(random_selector),
-                                    )
-                                ], align='center'
-                            ),
-                            dbc.Col(
-                                [
-                                    dbc.Button(
-                                        'Search', id='search-button', color="primary", n_clicks=0, class_name='custom-button')
-                                ], align='center'
-                            ),
-                            dbc.Col(
-                                [
-                                    dbc.Row([
-                                        dcc.DatePickerRange(
-                                            id="datepicker",
-                                            min_date_allowed=min(
-                                                data["comment_time"].dt.date),
-                                            end_date=max(
-                                                data["comment_time"].dt.date),
-                                            start_date=min(
-                                                data["comment_time"].dt.date),
-                                            clearable=False,
-                                            calendar_orientation='vertical'
-                                        ),
-                                    ],
-                                        justify='end')
-                                ], width='auto'
-                            ),
-                        ],
-                        style={'padding-bottom': '16px'}
-                    ),
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                [
-                                    dbc.Card(
-                                        [
-                                            dbc.CardBody(
-                                                [
-                                                    dls.Hash(
-                                                        dcc.Graph(
-                                                            id="time-graph"),
-                                                        color="#051923",
-                                                        speed_multiplier=2,
-                                                        size=100,
-                                                    )
-                                                ]
-                                            )
+def layout(**kwargs):
+    """Build the page when it is visited, so that the date range covers the latest data"""
+    first_day, last_day = date_range()
+    return html.Div(
+        [
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    [
+                                        dbc.Input(
+                                            id='input',
+                                            type='text',
+                                            placeholder='Enter keywords (comma-separated)',
+                                            value=random.choice(random_selector),
+                                        )
+                                    ], align='center'
+                                ),
+                                dbc.Col(
+                                    [
+                                        dbc.Button(
+                                            'Search', id='search-button', color="primary", n_clicks=0, class_name='custom-button')
+                                    ], align='center'
+                                ),
+                                dbc.Col(
+                                    [
+                                        dbc.Row([
+                                            dcc.DatePickerRange(
+                                                id="datepicker",
+                                                min_date_allowed=first_day,
+                                                end_date=last_day,
+                                                start_date=first_day,
+                                                clearable=False,
+                                                calendar_orientation='vertical'
+                                            ),
                                         ],
-                                        body=True
-                                    )
-                                ],
-                            )
-                        ],
-                        className="mb-3",
-                    )
-                ]
-            ),
-            className="w-100",
-        )
-    ]
-)
+                                            justify='end')
+                                    ], width='auto'
+                                ),
+                            ],
+                            style={'padding-bottom': '16px'}
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    [
+                                        dbc.Card(
+                                            [
+                                                dbc.CardBody(
+                                                    [
+                                                        dls.Hash(
+                                                            dcc.Graph(
+                                                                id="time-graph"),
+                                                            color="#051923",
+                                                            speed_multiplier=2,
+                                                            size=100,
+                                                        )
+                                                    ]
+                                                )
+                                            ],
+                                            body=True
+                                        )
+                                    ],
+                                )
+                            ],
+                            className="mb-3",
+                        )
+                    ]
+                ),
+                className="w-100",
+            )
+        ]
+    )
 
 
 @callback(
@@ -123,20 +100,16 @@ layout = html.Div(
     State('datepicker', 'end_date'),
     State('input', 'value')
 )
+@memoize(key=lambda n_clicks, start_date, end_date, keywords: (
+    start_date, end_date, normalise_keywords(keywords)))
 def search_keywords(n_clicks: int, start_date: str, end_date: str, keywords: str) -> go.Figure:
     """Returns a line graph based on the given keywords, for data between a given time frame."""
     if not keywords or not start_date or not end_date:
         return px.scatter()  # Return an empty scatter plot or a default figure
-    start_date = datetime.strptime(start_date, "%Y-%m-%d")
-    end_date = datetime.strptime(end_date, "%Y-%m-%d")
-
-    filtered_data = filter_data(keywords)
-    filtered_data = filtered_data[
-        (filtered_data['comment_time'] >= start_date) & (
-            filtered_data['comment_time'] <= end_date)
-    ]
-
-    # Perform any necessary data processing and filtering here
+    # Split the keywords by comma, and find the post keywords containing them
+    keywords = [keyword.strip() for keyword in keywords.split(",")]
+    filtered_data = sentiment_by_day(STORE.post_keywords.search_any(keywords),
+                                     start_date, end_date)
 
     # Create the graph
     fig = px.line(filtered_data, x='comment_time', y='sentiment')
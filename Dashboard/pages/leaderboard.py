@@ -1,72 +1,46 @@
 """Page for visualisation of top (or bottom) 10 organisations based on average sentiment."""
 import os
-import json
 from dash import register_page, dcc, html, callback
-from data import build_dataframe
+from data import label_sentiment_by_day
+from result_cache import memoize
 from datetime import datetime
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import pandas as pd
 import plotly.graph_objects as go
-import spacy
-import boto3
 import dash_loading_spinners as dls
 
-BUCKET_NAME = os.environ.get("bucket_name")
-s3 = boto3.resource(service_name='s3', region_name=os.environ.get("region_name"),
-                    aws_access_key_id=os.environ.get("access_key"), aws_secret_access_key=os.environ.get("secret_access_key"))
-BUCKET = s3.Bucket(BUCKET_NAME)
-FILE_KEY = "cache.json"
-FILE_PATH = '/tmp/cache.json'
-MODEL_SIZE = 'en_core_web_sm'
-nlp = spacy.load(MODEL_SIZE)
-data = build_dataframe().drop('comment_keyword', axis=1).drop_duplicates()
-
-# Check if a remote cache exists, else create one afresh
-cache = None
-try:
-    BUCKET.download_file(FILE_KEY, FILE_PATH)
-    with open(FILE_PATH) as cache_file:
-        cache = json.loads(cache_file.read())
-except:
-    cache = {}
+# Keywords labelled as organisations that are not actually organisations
+EXCLUDED_ORGANISATIONS = ['Bi-Weekly']
+# Number of organisations shown, the number of days an organisation needs sentiment for to be
+# ranked, and the number of most recent days ranked (0 ranks the whole history)
+LEADERBOARD_SIZE = 10
+MIN_DAYS = 2
+RANKING_DAYS = int(os.environ.get('LEADERBOARD_DAYS', 0))
 
 
 register_page(__name__, title="Leaderboard", path="/leaderboard")
 
 
 
-def is_organisation(x):
-    global cache
-    if x == 'Bi-Weekly':
-        return None
-    if x not in cache:
-        doc = nlp(x)
-        if len(doc.ents) == 0:
-            return None
-        entity = doc.ents[0]
-        cache[x] = entity.label_
-        if entity.label_ != 'ORG':
-            return None
-        return x
-    if cache[x] == 'ORG':
-        return x
-    return None
+def organisation_data():
+    """Return the daily sentiment of the keywords labelled as organisations when loaded,
+    over the ranking window"""
+    data = label_sentiment_by_day('ORG')
+    data = data[~data['post_keyword'].isin(EXCLUDED_ORGANISATIONS)]
+    if RANKING_DAYS and len(data):
+        data = data[data['comment_time'] > data['comment_time'].max() - pd.Timedelta(days=RANKING_DAYS)]
+    return data
 
 
-data['post_keyword'] = data['post_keyword'].apply(is_organisation)
-data.dropna()
-BUCKET.put_object(
-    Key="cache.json", Body=json.dumps(cache))
-
-
-def filter_data(filtered_data):
-    grouped_data = filtered_data.groupby(
-        [filtered_data['comment_time'].dt.date, filtered_data['post_keyword']])['sentiment'].mean()
-    grouped_data = grouped_data.to_frame().reset_index(level=[0, 1])
-    grouped_data['comment_time'] = pd.to_datetime(grouped_data['comment_time'])
-    return grouped_data
+def rank_organisations(data, positive: bool, size: int = LEADERBOARD_SIZE) -> list[str]:
+    """Return the organisations with the highest (or lowest) mean daily sentiment, among
+    those with sentiment for at least MIN_DAYS days"""
+    stats = data.groupby('post_keyword')['sentiment'].agg(['mean', 'count'])
+    means = stats.loc[stats['count'] >= MIN_DAYS, 'mean']
+    leaders = means.nlargest(size) if positive else means.nsmallest(size)
+    return leaders.index.tolist()
 
 
 radioitems = dbc.RadioItems(
@@ -137,35 +111,22 @@ layout = html.Div(
     Output('graph', 'figure'),
     Input('radioitems', 'value'),
 )
+@memoize()
 def generate_leaderboard(value: int) -> go.Figure:
     """Depending on the inputted value, returns the 10 organisations with either the best or worst average sentiment."""
 
-    grouped_data = filter_data(data)
+    grouped_data = organisation_data()
+    leaders = rank_organisations(grouped_data, positive=value == 1)
 
-    leaders = None
-    if value == 1:
-        leaders = grouped_data.sort_values(
-            ascending=False, by='sentiment')['post_keyword']
-    else:
-        leaders = grouped_data.sort_values(
-            ascending=True, by='sentiment')['post_keyword']
-
-    # Make the organizations distinct before plotting
-    leaders = leaders.drop_duplicates()
+    # Split the rows of the leaders in one pass, then plot them in order of rank
+    leader_data = grouped_data[grouped_data['post_keyword'].isin(leaders)].sort_values('comment_time')
+    leader_rows = dict(tuple(leader_data.groupby('post_keyword')))
 
     fig = go.Figure()
-
-    count = 0
     for organization in leaders:
-        organization_data = grouped_data[grouped_data['post_keyword']
-                                         == organization]
-        # Check if the organization has more than one data point
-        if len(organization_data) > 1:
-            fig.add_trace(go.Scatter(
-                x=organization_data['comment_time'], y=organization_data['sentiment'], name=organization))
-            count += 1
-        if count == 10:
-            break
+        organization_data = leader_rows[organization]
+        fig.add_trace(go.Scatter(
+            x=organization_data['comment_time'], y=organization_data['sentiment'], name=organization))
 
     fig.update_layout(
         xaxis_title='Time',
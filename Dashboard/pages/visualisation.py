@@ -1,79 +1,71 @@
 """wordcloud visualisations page for dash application"""
 from io import BytesIO
 from random import choice
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import base64
 from dash import register_page, html, callback
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
 import dash_loading_spinners as dls
-from data import build_dataframe
+from store import STORE
+from result_cache import memoize
 import pandas as pd
 from PIL import Image
 import numpy as np
 from numpy import ndarray
-from wordcloud import WordCloud
+from wordcloud import WordCloud, STOPWORDS
 from pandas import DataFrame
-BANNED_WORDS_FILEPATH = "./swearWords.txt"
-# Load in a list of banned words to exclude from the graph.
-with open(BANNED_WORDS_FILEPATH) as swears:
-    ban_words = []
-    for word in swears.readlines():
-        ban_words.append(word.strip())
+FONT_PATH = './assets/RomanVibes.otf'
+# Number of the most searched keywords whose clouds are rendered ahead of time, and the
+# number of distinct keywords whose searches are counted
+POPULAR_SEARCHES = 10
+TRACKED_SEARCHES = 1000
+DEFAULT_KEYWORD = 'Apple'
 
 
-register_page(__name__, title="Keywords", path="/keywords")
-DATA = build_dataframe()  # Load the data (replace with your actual data loading code)
-
-
-def dataframe_to_set(dataframe: DataFrame) -> set[str]:
-    """Turns a column of strings into one set of strings"""
-    entries = set()
-    for ind in dataframe.index:
-        entries.add(dataframe['comment_keyword'][ind])
-    return entries
+# Decode the masks once, rather than for every cloud
+MASKS = {
+    True: np.array(Image.open("./assets/uptwo.png")),
+    False: np.array(Image.open("./assets/downtwo.png"))
+}
 
-
-def dataframe_to_list(dataframe: DataFrame) -> list[str]:
-    """Turns a column of strings into one list of strings"""
-    entries = []
-    for ind in dataframe.index:
-        entries.append(dataframe['comment_keyword'][ind])
-    return entries
+register_page(__name__, title="Keywords", path="/keywords")
 
 
-def filter_dataframe(df: DataFrame, keyword: str, positive: bool, swears: bool = False) -> DataFrame:
+def filter_dataframe(keyword: str, positive: bool, swears: bool = False) -> DataFrame:
     """returns a dataframe that has been filtered"""
+    # Look up the rows of the posts with the keyword, rather than searching every row
+    df = STORE.rows_with_post_keywords(STORE.post_keywords.search(keyword))
     if positive:
         series = df['sentiment'] > 0
     else:
         series = df['sentiment'] < 0
-    to_filter = []
+    # Exclude the comment keywords containing the keyword, and those containing banned words
+    excluded = df['comment_keyword'].isin(STORE.comment_keywords.search(keyword))
     if not swears:
-        to_filter = ban_words
-    to_filter.append(keyword)
-    df = df.drop(
-        df[df['comment_keyword'].str.contains("|".join(to_filter), case=False)].index)
-    return df.loc[(df['post_keyword'].str.contains(keyword, case=False) & (series))].reset_index()
+        excluded |= df['banned']
+    return df.loc[~excluded & series].reset_index()
 
 
 def mask_selector(positive: bool) -> ndarray:
     """creates a mask for the wordcloud based on positivity"""
-    if positive:
-        image = Image.open("./assets/uptwo.png")
-    else:
-        image = Image.open("./assets/downtwo.png")
-    return np.array(image)
+    return MASKS[positive]
 
 
-def filter_text(filtered, opposite, keyword) -> str:
-    """filters text to make sure both wordclouds have unique words"""
-    text = ''
-    for word in filtered:
-        if (word in opposite) or (keyword.lower() in word) or (len(word) < 1):
-            continue
-        else:
-            text += word + ' '
-    return text[:-1]
+def keyword_frequencies(filtered: DataFrame, opposite: DataFrame, keyword: str) -> dict[str, int]:
+    """counts the comment keywords of the filtered rows by their category codes, leaving out
+    those in the opposite rows so that both wordclouds have unique words, and stopwords"""
+    categories = filtered['comment_keyword'].cat.categories
+    counts = np.bincount(filtered['comment_keyword'].cat.codes, minlength=len(categories))
+    opposite_codes = categories.get_indexer(opposite['comment_keyword'].unique())
+    counts[opposite_codes[opposite_codes >= 0]] = 0
+    counts[categories.str.contains(keyword.lower(), regex=False) | (categories.str.len() < 1)] = 0
+    # Leave out the common words WordCloud.generate removed, e.g. adjectives such as "other"
+    counts[categories.str.lower().isin(STOPWORDS)] = 0
+    present = np.flatnonzero(counts)
+    return dict(zip(categories[present], counts[present].tolist()))
 
 
 def custom_colours(*args, **kwargs) -> str:
@@ -82,17 +74,17 @@ def custom_colours(*args, **kwargs) -> str:
     return choice(colour_scheme)
 
 
-def generate_wordcloud(text: str, positive: bool) -> WordCloud:
-    """create a wordcloud from text"""
+def generate_wordcloud(frequencies: dict[str, int], positive: bool) -> WordCloud:
+    """create a wordcloud from the frequencies of keywords"""
     return WordCloud(
         mask=mask_selector(positive),
-        font_path='./assets/RomanVibes.otf',
+        font_path=FONT_PATH,
         width=800,
         height=600,
         min_font_size=14,
         background_color="#FFFFFF",
         color_func=custom_colours
-    ).generate(text)
+    ).generate_from_frequencies(frequencies)
 
 
 # Radio items for the swear filter
@@ -108,20 +100,18 @@ radioitems = dbc.RadioItems(
 )
 
 
-def key_word_cloud(df: DataFrame, keyword: str, positive: bool, swears: bool = False):
+def key_word_cloud(keyword: str, positive: bool, swears: bool = False):
     """takes a post keyword and sentiment and produces a wordcloud"""
     if swears:
-        filtered_df = filter_dataframe(df, keyword, positive, swears=True)
+        filtered_df = filter_dataframe(keyword, positive, swears=True)
     else:
-        filtered_df = filter_dataframe(df, keyword, positive)
+        filtered_df = filter_dataframe(keyword, positive)
     if positive:
-        opposite_df = filter_dataframe(df, keyword, False)
+        opposite_df = filter_dataframe(keyword, False)
     else:
-        opposite_df = filter_dataframe(df, keyword, True)
-    opposite = dataframe_to_set(opposite_df)
-    filtered = dataframe_to_list(filtered_df)
-    text = filter_text(filtered, opposite, keyword)
-    word_cloud = generate_wordcloud(text, positive)
+        opposite_df = filter_dataframe(keyword, True)
+    frequencies = keyword_frequencies(filtered_df, opposite_df, keyword)
+    word_cloud = generate_wordcloud(frequencies, positive)
     return word_cloud
 
 
@@ -138,7 +128,7 @@ layout = html.Div(
                                                 id='input',
                                                 type='text',
                                                 placeholder='Enter keyword',
-                                                value='Apple'
+                                                value=DEFAULT_KEYWORD
                                             )
                                         ]
                                     ),
@@ -218,6 +208,46 @@ layout = html.Div(
 )
 
 
+@memoize(key=lambda keyword, positive, swears: (keyword.lower(), positive, swears, STORE.version))
+def word_cloud_image(keyword: str, positive: bool, swears: bool) -> str:
+    """Render a wordcloud as a png data url. Images are cached per keyword (ignoring case, as
+    the clouds do), polarity, swear filter and version of the data."""
+    image = BytesIO()
+    key_word_cloud(keyword, positive=positive, swears=swears).to_image().save(image, format='PNG')
+    return 'data:image/png;base64,{}'.format(base64.b64encode(image.getvalue()).decode())
+
+
+# Keywords searched since the app started, and a worker rendering the most popular ahead of time
+searches = Counter()
+searches_lock = threading.Lock()
+precompute_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def precompute_popular():
+    """Render the clouds of the most searched keywords, so they are cached before being asked for"""
+    with searches_lock:
+        popular = [keyword for keyword, _ in searches.most_common(POPULAR_SEARCHES)]
+    for keyword in popular:
+        try:
+            for swears in [False, True]:
+                word_cloud_image(keyword, True, swears)
+                word_cloud_image(keyword, False, swears)
+        except ValueError as error:
+            # Raised by WordCloud when no words are left for a cloud
+            print(f"Could not precompute the clouds for {keyword}: {error}")
+
+
+def schedule_precompute():
+    """Render the popular clouds in the background"""
+    precompute_executor.submit(precompute_popular)
+
+
+# The cache is emptied when the data is refreshed, so the popular clouds are rendered again
+STORE.on_refresh(schedule_precompute)
+searches[DEFAULT_KEYWORD.lower()] += 1
+schedule_precompute()
+
+
 @callback(
     Output('positive-wordcloud', 'src'),
     Output('negative-wordcloud', 'src'),
@@ -227,17 +257,21 @@ layout = html.Div(
 )
 def update_wordclouds(n_clicks: int, swears: int, keyword: str) -> tuple:
     """Return two wordclouds in png format based on inputted values for the swear filter and keyword."""
+    keyword = keyword.strip() if keyword else keyword
     if keyword:
-        positive_img, negative_img = BytesIO(), BytesIO()
+        with searches_lock:
+            searches[keyword.lower()] += 1
+            if len(searches) > TRACKED_SEARCHES:
+                # Forget the least searched keywords, keeping the counter bounded
+                popular = searches.most_common(TRACKED_SEARCHES // 2)
+                searches.clear()
+                searches.update(dict(popular))
         show_swears = False
         if swears == 1:
             show_swears = True
 
-        key_word_cloud(DATA, keyword, positive=True, swears=show_swears).to_image().save(
-            positive_img, format='PNG')
-        key_word_cloud(DATA, keyword, positive=False, swears=show_swears).to_image().save(
-            negative_img, format='PNG')
-        return 'data:image/png;base64,{}'.format(base64.b64encode(positive_img.getvalue()).decode()), 'data:image/png;base64,{}'.format(base64.b64encode(negative_img.getvalue()).decode())
+        return (word_cloud_image(keyword, True, show_swears),
+                word_cloud_image(keyword, False, show_swears))
     else:
         return None, None
 
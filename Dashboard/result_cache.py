@@ -0,0 +1,53 @@
+"""Module for caching the results of dashboard callbacks, so repeated searches are not recomputed."""
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from store import STORE
+
+# Number of results kept per callback, and the seconds before a result is recomputed
+CACHE_SIZE = 128
+CACHE_TTL = 600
+
+
+def normalise_keywords(keywords: str) -> tuple:
+    """Return comma separated keywords in a form equal for every equivalent search"""
+    if not keywords:
+        return ()
+    return tuple(sorted({keyword.strip().casefold() for keyword in keywords.split(",")}))
+
+
+def memoize(key=None, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+    """Decorator caching the results of a function by its arguments, or by the value of
+    key(*args) when given. The least recently used results are evicted past size, results
+    expire after ttl seconds, and every result is discarded when the data is refreshed."""
+    def decorator(function):
+        results = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(function)
+        def wrapper(*args):
+            cache_key = key(*args) if key else args
+            with lock:
+                if cache_key in results:
+                    created, result = results[cache_key]
+                    if time.monotonic() - created < ttl:
+                        results.move_to_end(cache_key)
+                        return result
+                    del results[cache_key]
+
+            result = function(*args)
+            with lock:
+                results[cache_key] = (time.monotonic(), result)
+                while len(results) > size:
+                    results.popitem(last=False)
+            return result
+
+        def cache_clear():
+            with lock:
+                results.clear()
+
+        wrapper.cache_clear = cache_clear
+        STORE.on_refresh(cache_clear)
+        return wrapper
+    return decorator
@@ -0,0 +1,138 @@
+"""Module holding the dashboard data, loaded once when the app starts and shared by every page.
+Pages that only plot aggregates query them from the database through data.py instead."""
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import union_categoricals
+from data import build_dataframe, build_new_rows, compact_dataframe, text_size
+from keyword_index import KeywordIndex
+from banned_words import contains_banned_word
+
+# Minutes between refreshes of the data while the dashboard is running
+REFRESH_MINUTES = float(os.environ.get('REFRESH_MINUTES', 30))
+# Comments are loaded by parallel transactions, so a comment id can become visible after
+# a greater one. Refreshes re-read this many ids below the greatest seen to catch them.
+REFRESH_OVERLAP = 10000
+
+
+def append_rows(dataframe: DataFrame, rows: DataFrame) -> DataFrame:
+    """Append rows to a compact dataframe, keeping its categorical columns categorical."""
+    categorical = dataframe.select_dtypes('category').columns
+    combined = pd.concat([dataframe.drop(categorical, axis=1), rows.drop(categorical, axis=1)],
+                         ignore_index=True)
+    for column in categorical:
+        combined[column] = union_categoricals([dataframe[column], rows[column]],
+                                              ignore_order=True)
+    return combined[dataframe.columns]
+
+
+class DataStore:
+    """The datasets used by the dashboard pages. Pages should read them through the
+    properties when handling a callback, and treat them as read-only."""
+
+    def __init__(self):
+        self._snapshot = None
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.version = 0
+        self.load()
+
+    def load(self):
+        """Read the datasets from the database, replacing any previously loaded."""
+        start = time.perf_counter()
+        full = build_dataframe(compact=True)
+        self._swap(full)
+        print(f"Loaded {len(full)} rows in {time.perf_counter() - start:.1f}s, "
+              f"using {sum(self.memory_usage().values()) / 1e6:.1f} MB "
+              f"({text_size() / 1e6:.1f} MB of text before compacting)")
+
+    def refresh(self) -> bool:
+        """Append the rows of comments loaded since the last refresh. Returns whether there
+        was new data."""
+        start = time.perf_counter()
+        full = self.full
+        last_comment_id = full['comment_id'].max() if len(full) else 0
+        known_ids = full.loc[full['comment_id'] > last_comment_id - REFRESH_OVERLAP, 'comment_id']
+
+        new_rows = compact_dataframe(build_new_rows(last_comment_id - REFRESH_OVERLAP))
+        new_rows = new_rows[~new_rows['comment_id'].isin(known_ids)]
+        if new_rows.empty:
+            return False
+
+        # New comments only have new keywords, and can only add to existing posts, so
+        # appending their rows gives the same frame as reloading everything
+        self._swap(append_rows(full, new_rows))
+        print(f"Refreshed {len(new_rows)} new rows in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def _swap(self, full: DataFrame):
+        """Replace the datasets and their keyword indexes in one step, then let anything
+        derived from them know they have changed."""
+        # Check each distinct comment keyword for banned words once, rather than on every search
+        comment_keywords = full['comment_keyword'].cat
+        full['banned'] = contains_banned_word(comment_keywords.categories)[comment_keywords.codes]
+        post_keywords = KeywordIndex(full['post_keyword'].cat.categories)
+        comment_keywords = KeywordIndex(full['comment_keyword'].cat.categories)
+        post_keyword_rows = full.groupby('post_keyword', observed=True).indices
+        with self._lock:
+            self._snapshot = (full, post_keywords, comment_keywords, post_keyword_rows)
+            self.version += 1
+        for hook in self._hooks:
+            hook()
+
+    def on_refresh(self, hook):
+        """Register a function to call whenever the datasets change, e.g. to clear a cache."""
+        self._hooks.append(hook)
+
+    def start_refresh(self, minutes: float = REFRESH_MINUTES) -> threading.Thread:
+        """Refresh the datasets in a background thread every few minutes."""
+        def refresh_periodically():
+            while not self._stopped.wait(minutes * 60):
+                try:
+                    self.refresh()
+                except Exception as error:
+                    # Keep serving the current data, and try again next time
+                    print(f"Failed to refresh the data: {error}")
+
+        thread = threading.Thread(target=refresh_periodically, daemon=True)
+        thread.start()
+        return thread
+
+    def stop_refresh(self):
+        """Stop the background refresh."""
+        self._stopped.set()
+
+    @property
+    def full(self) -> DataFrame:
+        """One row per comment, comment keyword and post keyword. The banned column tells
+        whether the comment keyword contains a banned word."""
+        return self._snapshot[0]
+
+    @property
+    def post_keywords(self) -> KeywordIndex:
+        """Index of the post keywords, to find those matching a search."""
+        return self._snapshot[1]
+
+    @property
+    def comment_keywords(self) -> KeywordIndex:
+        """Index of the comment keywords, to find those matching a search."""
+        return self._snapshot[2]
+
+    def rows_with_post_keywords(self, post_keywords: list[str]) -> DataFrame:
+        """Return the rows of the full frame with any of the given post keywords, looking
+        up their positions rather than comparing every row."""
+        full, _, _, post_keyword_rows = self._snapshot
+        positions = [post_keyword_rows[keyword] for keyword in post_keywords
+                     if keyword in post_keyword_rows]
+        return full.iloc[np.sort(np.concatenate(positions))] if positions else full.iloc[:0]
+
+    def memory_usage(self) -> dict[str, int]:
+        """Return the number of bytes used by each dataset."""
+        return {'full': int(self.full.memory_usage(deep=True).sum())}
+
+
+STORE = DataStore()
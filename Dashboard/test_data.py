@@ -1,4 +1,10 @@
-from data import build_dataframe
+from data import (build_dataframe, date_range, sentiment_by_day, titles_for_date, label_sentiment_by_day,
+                  comment_text, text_size)
+from store import STORE
+from keyword_index import KeywordIndex
+from result_cache import memoize, normalise_keywords
+from banned_words import compile_matcher, contains_banned_word
+import pandas as pd
 import pandas.api.types as ptypes
 DATAFRAME = build_dataframe()
 
@@ -24,3 +30,96 @@ def test_data_types():
         DATAFRAME[col]) for col in ['comment', 'comment_keyword', 'post_keyword', 'title'])
     assert all(ptypes.is_datetime64_any_dtype(
         DATAFRAME[col]) for col in ['post_time', 'comment_time'])
+
+
+def test_sentiment_by_day():
+    """Test that the daily sentiment of all posts covers the whole date range"""
+    first_day, last_day = date_range()
+    sentiment = sentiment_by_day(STORE.post_keywords.search(''), str(first_day), str(last_day))
+    assert list(sentiment.columns.values) == ['comment_time', 'sentiment']
+    assert sentiment['comment_time'].min().date() == first_day
+    assert sentiment['sentiment'].between(-1, 1).all()
+
+
+def test_label_sentiment_by_day():
+    """Test that the daily sentiment of labelled keywords is returned per keyword"""
+    sentiment = label_sentiment_by_day('ORG')
+    assert list(sentiment.columns.values) == ['comment_time', 'post_keyword', 'sentiment']
+
+
+def test_titles_for_date():
+    """Test that titles are counted for a date, most commented first"""
+    titles = titles_for_date(STORE.post_keywords.search(''), str(date_range()[1]))
+    assert len(titles) > 0
+    assert titles['comment'].is_monotonic_decreasing
+
+
+def test_compact_dataframe():
+    """Test that the compact dataframe has the same rows as the full one, without comment text"""
+    compact = build_dataframe(compact=True)
+    assert 'comment' not in compact.columns
+    assert compact['sentiment'].dtype == 'float32'
+    expected = DATAFRAME.drop('comment', axis=1)
+    assert len(compact) == len(expected)
+    assert compact['comment_id'].sort_values().tolist() == expected['comment_id'].sort_values().tolist()
+
+
+def test_comment_text():
+    """Test that comment text left out of the compact dataframe can be fetched by id"""
+    comment_ids = DATAFRAME['comment_id'].unique()[:2].tolist()
+    texts = comment_text(comment_ids).set_index('comment_id')['comment']
+    expected = DATAFRAME.drop_duplicates('comment_id').set_index('comment_id')['comment']
+    assert texts.sort_index().equals(expected.loc[sorted(comment_ids)])
+    assert text_size() > 0
+
+
+def test_store_frame():
+    """Test that the shared store holds the full frame in a compact form, without comment text"""
+    assert list(STORE.full.columns.values) == [column for column in DATAFRAME.columns.values
+                                               if column != 'comment'] + ['banned']
+    assert all(isinstance(STORE.full[col].dtype, pd.CategoricalDtype)
+               for col in ['comment_keyword', 'post_keyword', 'title'])
+    assert STORE.full['sentiment'].dtype == 'float32'
+    assert all(size > 0 for size in STORE.memory_usage().values())
+
+
+def test_store_refresh_without_new_rows():
+    """Test that refreshing when nothing new has been loaded keeps the current data"""
+    version = STORE.version
+    assert not STORE.refresh()
+    assert STORE.version == version
+
+
+def test_keyword_index_search():
+    """Test that keywords are found by case insensitive, literal substring search"""
+    index = KeywordIndex(['Apple', 'apple inc', 'Pineapple', 'OpenAI', 'C++'])
+    assert index.search('APPLE') == ['Apple', 'apple inc', 'Pineapple']
+    assert index.search('pp') == ['Apple', 'apple inc', 'Pineapple']
+    assert index.search('c++') == ['C++']
+    assert index.search('google') == []
+    assert index.search_any(['open', 'inc']) == ['OpenAI', 'apple inc']
+
+
+def test_memoize():
+    """Test that results are cached by normalised input, evicted and cleared on refresh"""
+    calls = []
+
+    @memoize(key=lambda n_clicks, keywords: normalise_keywords(keywords), size=2)
+    def search(n_clicks, keywords):
+        calls.append(keywords)
+        return len(calls)
+
+    assert search(1, "Apple, OpenAI") == search(2, "openai,apple ") == 1
+    search(3, "Tesla")
+    search(4, "Google")
+    assert search(5, "Apple, OpenAI") == 4
+    search.cache_clear()
+    assert search(6, "Apple, OpenAI") == 5
+
+
+def test_contains_banned_word():
+    """Test that banned words are found anywhere in a keyword, ignoring case"""
+    pattern = compile_matcher(['damn', 'blow job', 'c++'])
+    assert contains_banned_word(['Goddamnit', 'Blow Job', 'C++', 'Apple'], pattern).tolist() == [
+        True, True, True, False]
+    assert not contains_banned_word(['Apple'], compile_matcher([])).any()
@@ -1,22 +1,110 @@
 """Script to extract data from reddit using PRAW, and send it to an S3 bucket"""
+import time
+IMPORT_START = time.perf_counter()  # Imports are the first phase of a cold start
 import os
 import json
+import gzip
 import datetime
+import uuid
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from itertools import islice
+from typing import Callable, Iterable, Iterator
 import praw
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from dotenv import load_dotenv
-import en_core_web_lg
-import nltk
+from spacy.language import Language
+import spacy
 import boto3
+from sentiment import SentimentScorer
+from workers import WorkerPool
 
-nltk.data.path.append("/tmp")
-nltk.download("vader_lexicon", download_dir="/tmp")
 load_dotenv()
 
-nlp = en_core_web_lg.load()
-sia = SentimentIntensityAnalyzer()  # Initialise Vader SentimentIntensityAnalyzer
+# Seconds taken by each phase of a cold start, reported once by the first invocation
+STARTUP_TIMES: dict[str, float] = {"imports": time.perf_counter() - IMPORT_START}
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Context manager recording how long a phase of the cold start takes"""
+    start = time.perf_counter()
+    yield
+    STARTUP_TIMES[name] = time.perf_counter() - start
+
+
+def report_startup():
+    """Print the time taken by each phase of the cold start, if it has not been printed"""
+    if STARTUP_TIMES:
+        print("Cold start: " + ", ".join(
+            f"{name} {seconds:.2f}s" for name, seconds in STARTUP_TIMES.items()))
+        STARTUP_TIMES.clear()
+
+# spaCy model used for each value of the spacy_model environment variable
+SPACY_MODELS = {
+    "sm": "en_core_web_sm",
+    "md": "en_core_web_md",
+    "lg": "en_core_web_lg"
+}
+# Only entities and part-of-speech tags are read, so the components producing anything
+# else are never loaded. tok2vec, tagger, attribute_ruler and ner are kept.
+EXCLUDED_COMPONENTS = ["parser", "lemmatizer", "senter"]
+
+
+def load_nlp(model_size: str = 'lg') -> Language:
+    """Load the extraction profile of the spaCy model with the given size"""
+    if model_size not in SPACY_MODELS:
+        raise ValueError(
+            f"Unknown spaCy model size '{model_size}', expected one of {list(SPACY_MODELS)}")
+    return spacy.load(SPACY_MODELS[model_size], exclude=EXCLUDED_COMPONENTS)
+
+
+# The models are loaded by the first invocation rather than at import, in the background
+# while it starts fetching from Reddit, and kept for the warm invocations after it.
+# The lock makes every other thread wait for the one loading them.
+models_lock = threading.Lock()
+# The thread loading the models, which must have finished before the workers are forked
+model_loader: threading.Thread = None
+
+
+@cache
+def load_models() -> tuple[Language, SentimentScorer]:
+    """Load the spaCy model, and Vader with a cache of the scores of repeated comments"""
+    with startup_phase("spaCy model"):
+        nlp = load_nlp(os.environ.get("spacy_model", "lg"))
+    with startup_phase("Vader lexicon"):
+        scorer = SentimentScorer()
+    return nlp, scorer
+
+
+def get_models() -> tuple[Language, SentimentScorer]:
+    """Return the spaCy model and Vader, waiting for them to be loaded if needed"""
+    with models_lock:
+        return load_models()
+
+
 NUM_POSTS = os.environ.get("num_posts")
 SUBREDDIT_NAME = os.environ.get("subreddit_name")
+# Batches are uploaded under BATCH_PREFIX, and announced by a manifest of the same name
+# under MANIFEST_PREFIX once complete. The loader relies on both conventions.
+BATCH_PREFIX = "batches/"
+MANIFEST_PREFIX = "manifests/"
+# Number of texts analysed per batch, and the number of worker processes analysing them.
+# The Lambda's vCPUs grow with its memory, e.g. 2 at 3 GB.
+NLP_BATCH_SIZE = int(os.environ.get("nlp_batch_size", 256))
+NLP_PROCESSES = int(os.environ.get("nlp_processes", 1))
+KEYWORD_LABELS = ['ORG', 'LOC', 'PRODUCT']
+# Only analyse comments that previous runs have not seen, tracked in a checkpoint per subreddit
+INCREMENTAL = os.environ.get("incremental", "true").lower() == "true"
+CHECKPOINT_PREFIX = "checkpoints/"
+# Number of threads downloading comment trees, and the Reddit API budget they share.
+# Each post costs one request.
+FETCH_WORKERS = int(os.environ.get("fetch_workers", 4))
+REQUESTS_PER_MINUTE = int(os.environ.get("requests_per_minute", 60))
+FETCH_QUEUE_SIZE = 2 * FETCH_WORKERS
 
 config = {
     "user_agent": os.environ.get("user_agent"),
@@ -25,74 +113,330 @@ config = {
 }
 
 
-def fetch_posts(reddit: praw.Reddit, subreddit_name='technology', num_posts=1) -> list:
-    """Function to fetch the top N posts from a subreddit"""
+class RateLimiter:
+    """Spaces out calls made from several threads so they stay within a request budget"""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60 / requests_per_minute
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request is allowed"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+
+def create_reddit() -> praw.Reddit:
+    """Create a Reddit client from the configured credentials"""
+    return praw.Reddit(
+        client_id=config["client_id"],
+        client_secret=config["client_secret"],
+        user_agent=config["user_agent"]
+    )
+
+
+def iter_posts(reddit: praw.Reddit, subreddit_name='technology', num_posts=1,
+               checkpoint: dict = None) -> Iterator[dict]:
+    """Generator fetching the top N posts from a subreddit, yielding each post as soon as
+    its comments have been analysed so that the run never holds every post in memory.
+    When a checkpoint is given, only the comments it has not seen are kept, posts without
+    any are left out, and once every post has been yielded the checkpoint is replaced
+    with the progress of this run."""
     print("Fetching posts...")
     subreddit = reddit.subreddit(subreddit_name)
     hot_posts = subreddit.hot(limit=int(num_posts))
 
-    posts_data: list[dict] = []
+    posts_data = [{
+        'id': post.id,
+        'title': post.title,
+        'entities': [],
+        'keywords': [],
+        'datetime': str(datetime.datetime.utcfromtimestamp(post.created_utc)),
+        'comments': []
+    } for post in hot_posts]
+    progress: dict[str, dict] = {}
 
-    for post in hot_posts:
-        # replace slashes with 'or' for Spacy recognition
-        title = post.title.replace('/', ' or ')
-        doc = nlp(title)
-        entities = [(ent.text, ent.label_) for ent in doc.ents]
-        adjectives = [token.text for token in doc if token.pos_ == 'ADJ']
-        keywords = [ent[0]
-                    for ent in entities if ent[1] in ['ORG', 'LOC', 'PRODUCT']]
-        post_data = {
-            'id': post.id,
-            'title': post.title,
-            'entities': entities,
-            'keywords': keywords + adjectives,
-            'datetime': str(datetime.datetime.utcfromtimestamp(post.created_utc)),
-            'comments': []
-        }
+    print("Analysing titles...")
+    analyse_titles(posts_data)  # Also forks the NLP workers, before any threads are started
 
-        # Analyze comments for each post
-        analyse_comments(reddit, post_data)
+    # Comment trees are downloaded by a pool of threads while the NLP stage analyses
+    # the posts already fetched. The bounded queue stops fetching from running too far
+    # ahead of the analysis.
+    fetched = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+    rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+    remaining: dict[str, int] = {}  # Comments of each post still to be analysed
+    without_comments: list[dict] = []
+    # PRAW clients cannot be shared between threads, so each fetching thread creates its own
+    clients = threading.local()
 
-        posts_data.append(post_data)
+    def fetch(post_data: dict):
+        """Fetch the comments of a post and pass it on to the NLP stage"""
+        try:
+            previous = checkpoint.get(post_data['id']) if checkpoint is not None else None
+            if not hasattr(clients, 'reddit'):
+                clients.reddit = create_reddit()
+            rate_limiter.wait()
+            progress[post_data['id']] = fetch_comments(clients.reddit, post_data, previous)
+        finally:
+            fetched.put(post_data)
 
-    return posts_data
+    def fetched_comments():
+        """Yield the comments of each post, with their context, as soon as it is fetched"""
+        for _ in range(num_fetches):
+            post_data = fetched.get()
+            if not post_data['comments']:
+                # Skip posts that were processed before and have no new comments
+                if checkpoint is None or post_data['id'] not in checkpoint:
+                    without_comments.append(post_data)
+                continue
+            remaining[post_data['id']] = len(post_data['comments'])
+            for comment in post_data['comments']:
+                yield comment['comment'], (comment, post_data)
 
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = [executor.submit(fetch, post_data) for post_data in posts_data]
+        num_fetches = len(futures)
+        posts_data.clear()  # Posts are only held until they have been yielded
 
-def analyse_comments(reddit: praw.Reddit, post_data: dict):
-    """Function to analyze the sentiment and scores of comments in the given post"""
+        print("Analysing comments...")
+        try:
+            for (keywords, sentiment), (comment, post_data) in analyse_in_batches(
+                    analyse_comment_batch, fetched_comments()):
+                comment['keywords'], comment['sentiment'] = keywords, sentiment
+                remaining[post_data['id']] -= 1
+                if not remaining[post_data['id']]:
+                    del remaining[post_data['id']]
+                    yield post_data
+        except BaseException:
+            # Unblock the fetching threads so the pool can shut down
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    fetched.get(timeout=1)
+                except queue.Empty:
+                    pass
+            raise
+        for future in futures:
+            future.result()  # Raise any error from fetching
+
+    yield from without_comments
+
+    if checkpoint is not None:
+        # Posts that left the listing are dropped, keeping the checkpoint bounded
+        checkpoint.clear()
+        checkpoint.update(progress)
+
+
+def fetch_posts(reddit: praw.Reddit, subreddit_name='technology', num_posts=1,
+                checkpoint: dict = None) -> list:
+    """Function to fetch the top N posts from a subreddit, see iter_posts"""
+    return list(iter_posts(reddit, subreddit_name, num_posts, checkpoint))
+
+
+def fetch_comments(reddit: praw.Reddit, post_data: dict, previous: dict = None) -> dict:
+    """Function to download the comments of the given post, ready for analysis.
+    Comments already recorded in the previous progress of the post are skipped, and the
+    updated progress (seen comment ids and the newest comment time) is returned."""
     post = praw.models.Submission(reddit, id=post_data['id'])
     post.comments.replace_more(limit=0)
 
+    if previous is None:
+        previous = {'seen': [], 'last_created_utc': 0}
+    seen = set(previous['seen'])
+    last_created_utc = previous['last_created_utc']
+
     for comment in post.comments.list():
-        # replace slashes with 'or' for Spacy recognition
-        text = comment.body.replace('/', ' or ')
-        doc = nlp(text)
-        entities = [(ent.text, ent.label_) for ent in doc.ents]
-        adjectives = [token.text.lower()
-                      for token in doc if token.pos_ == 'ADJ']
-        keywords = [ent[0].lower() for ent in entities if ent[1]
-                    in ['ORG', 'LOC', 'PRODUCT']]
-        sentiment = sia.polarity_scores(text)  # Use Vader to analyze sentiment
+        created_utc = float(comment.created_utc)
+        # Comments newer than the previous run are new without checking the seen ids
+        if created_utc <= previous['last_created_utc'] and comment.id in seen:
+            continue
+        seen.add(comment.id)
+        last_created_utc = max(last_created_utc, created_utc)
+
         post_data['comments'].append({
-            'comment': text,
-            'keywords': keywords + adjectives,
-            'sentiment': sentiment,
-            'datetime': str(datetime.datetime.utcfromtimestamp(comment.created_utc)),
+            'id': comment.id,
+            # replace slashes with 'or' for Spacy recognition
+            'comment': comment.body.replace('/', ' or '),
+            'keywords': [],
+            'sentiment': {},
+            'datetime': str(datetime.datetime.utcfromtimestamp(created_utc)),
             'score': comment.score
         })
 
+    return {'seen': list(seen), 'last_created_utc': last_created_utc}
+
+
+def load_checkpoint(bucket, subreddit_name: str) -> dict:
+    """Load the progress of every post processed by the last run on a subreddit"""
+    try:
+        checkpoint = bucket.Object(f"{CHECKPOINT_PREFIX}{subreddit_name}.json").get()
+    except bucket.meta.client.exceptions.NoSuchKey:
+        print("No checkpoint found, fetching every comment.")
+        return {}
+    return json.loads(checkpoint['Body'].read())
+
+
+def save_checkpoint(bucket, subreddit_name: str, checkpoint: dict):
+    """Save the progress of every post processed on a subreddit"""
+    bucket.put_object(Key=f"{CHECKPOINT_PREFIX}{subreddit_name}.json",
+                      Body=json.dumps(checkpoint))
+
+
+def pipe_documents(texts):
+    """Stream texts through the spaCy pipeline in batches"""
+    nlp, _ = get_models()
+    return nlp.pipe(texts, batch_size=NLP_BATCH_SIZE)
+
+
+@cache
+def get_workers() -> WorkerPool:
+    """Return the worker processes, forking them the first time once the models are loaded.
+    This must happen before any threads are started, as a forked process only gets a copy
+    of the calling thread."""
+    if model_loader is not None:
+        model_loader.join()
+    get_models()
+    with startup_phase("worker processes"):
+        return WorkerPool(NLP_PROCESSES)
+
+
+def analyse_in_batches(function: Callable, items: Iterable[tuple]) -> Iterator[tuple]:
+    """Yield (result, context) for each (text, context) item, applying the function to
+    batches of NLP_BATCH_SIZE texts across the worker processes, in the order given"""
+    contexts = deque()
+
+    def text_batches():
+        items_left = iter(items)
+        while batch := list(islice(items_left, NLP_BATCH_SIZE)):
+            contexts.extend(context for _, context in batch)
+            yield [text for text, _ in batch]
+
+    for results in get_workers().map(function, text_batches()):
+        for result in results:
+            yield result, contexts.popleft()
+
+
+def find_keywords(doc, lowercase: bool = False) -> tuple[list, list]:
+    """Function to return the entities of a document, and the keywords made up of
+    its organisations, locations, products and adjectives"""
+    entities = [(ent.text, ent.label_) for ent in doc.ents]
+    adjectives = [token.text for token in doc if token.pos_ == 'ADJ']
+    keywords = [ent[0] for ent in entities if ent[1] in KEYWORD_LABELS]
+    keywords += adjectives
+    if lowercase:
+        keywords = [keyword.lower() for keyword in keywords]
+    return entities, keywords
+
+
+def analyse_title_batch(titles: list[str]) -> list[tuple[list, list]]:
+    """Function to return the entities and keywords of each of a batch of titles"""
+    return [find_keywords(doc) for doc in pipe_documents(titles)]
+
+
+def analyse_comment_batch(texts: list[str]) -> list[tuple[list, dict]]:
+    """Function to return the keywords and Vader sentiment of each of a batch of comments"""
+    _, scorer = get_models()
+    sentiments = scorer.score_batch(texts)
+    return [(find_keywords(doc, lowercase=True)[1], sentiment)
+            for doc, sentiment in zip(pipe_documents(texts), sentiments)]
+
+
+def analyse_titles(posts_data: list[dict]):
+    """Function to extract the entities and keywords from the titles of the given posts"""
+    # replace slashes with 'or' for Spacy recognition
+    titles = ((post_data['title'].replace('/', ' or '), post_data) for post_data in posts_data)
+
+    for (entities, keywords), post_data in analyse_in_batches(analyse_title_batch, titles):
+        post_data['entities'], post_data['keywords'] = entities, keywords
+
+
+def analyse_comment_list(comments: list[dict]):
+    """Function to analyze the keywords and sentiment of the given comments"""
+    texts = ((comment['comment'], comment) for comment in comments)
+
+    for (keywords, sentiment), comment in analyse_in_batches(analyse_comment_batch, texts):
+        comment['keywords'], comment['sentiment'] = keywords, sentiment
+
+
+def analyse_comments(reddit: praw.Reddit, post_data: dict):
+    """Function to analyze the sentiment and scores of comments in the given post"""
+    fetch_comments(reddit, post_data)
+    analyse_comment_list(post_data['comments'])
+
+
+def parse_shards(subreddits: str) -> list[dict]:
+    """Parse a comma-separated list of subreddit:num_posts pairs into extraction shards"""
+    shards = []
+    for shard in subreddits.split(","):
+        subreddit_name, _, num_posts = shard.strip().partition(":")
+        shards.append({'subreddit': subreddit_name, 'num_posts': int(num_posts or NUM_POSTS)})
+    return shards
+
+
+# Subreddits to extract, as "name:num_posts" pairs separated by commas. Each one is a
+# shard with its own output object and checkpoint, defaulting to subreddit_name/num_posts.
+SHARDS = parse_shards(os.environ.get("subreddits")) if os.environ.get("subreddits") else [
+    {'subreddit': SUBREDDIT_NAME, 'num_posts': NUM_POSTS}]
+
+
+def extract_subreddit(reddit: praw.Reddit, bucket, subreddit_name: str, num_posts) -> str:
+    """Extract the hot posts of one subreddit into a new batch object, returning its key.
+    Posts are written to a gzipped file with one JSON record per line as they are analysed.
+    Once the batch is uploaded, a manifest announces it to the loader."""
+    checkpoint = load_checkpoint(bucket, subreddit_name) if INCREMENTAL else None
+
+    # Every run writes a uniquely named batch, so nothing is overwritten before it is loaded
+    created = datetime.datetime.utcnow()
+    batch_id = f"{subreddit_name}/{created:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    file_name = f"{BATCH_PREFIX}{batch_id}.jsonl.gz"
+    file_path = f"/tmp/{batch_id.replace('/', '-')}.jsonl.gz"
+    num_written, num_comments = 0, 0
+    try:
+        with gzip.open(file_path, 'wt', encoding='utf-8') as file:
+            for post_data in iter_posts(reddit, subreddit_name, num_posts, checkpoint):
+                file.write(json.dumps(post_data) + "\n")
+                num_written += 1
+                num_comments += len(post_data['comments'])
+        print(f"Found {num_comments} new comments across {num_written} posts in r/{subreddit_name}.")
+
+        print("Uploading file...")
+        bucket.upload_file(file_path, file_name)
+    finally:
+        # A warm Lambda keeps /tmp, so the file is removed even if the run fails
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    bucket.put_object(Key=f"{MANIFEST_PREFIX}{batch_id}.json", Body=json.dumps({
+        'key': file_name,
+        'subreddit': subreddit_name,
+        'created': str(created),
+        'posts': num_written,
+        'comments': num_comments
+    }))
+
+    # Only record progress once the data it covers has been uploaded
+    if checkpoint is not None:
+        save_checkpoint(bucket, subreddit_name, checkpoint)
+
+    print("File uploaded.")
+    return file_name
+
 
 def lambda_handler(event, context):
-    """AWS Lambda handler function"""
-    user_agent = config["user_agent"]
-    client_id = config["client_id"]
-    client_secret = config["client_secret"]
-
-    reddit = praw.Reddit(
-        client_id=client_id,
-        client_secret=client_secret,
-        user_agent=user_agent
-    )
+    """AWS Lambda handler function. The event may name a single shard to extract
+    ({"subreddit": ..., "num_posts": ...}), otherwise every configured shard is extracted.
+    Returns the keys of the uploaded objects for the load step."""
+    # Load the models (on a cold start) while connecting to Reddit and S3
+    global model_loader
+    if model_loader is None:
+        model_loader = threading.Thread(target=get_models, daemon=True)
+        model_loader.start()
+
+    reddit = create_reddit()
 
     # Check if the Reddit API is connecting properly
     if reddit.read_only:
@@ -101,20 +445,15 @@ def lambda_handler(event, context):
         print("Failed to connect to the Reddit API")
         return None # Terminate the script if the API connection failed
 
-    posts_data = fetch_posts(reddit, SUBREDDIT_NAME, NUM_POSTS)
-
     print("Connecting to bucket...")
     s3 = boto3.resource(service_name='s3', region_name=os.environ.get("region_name"),
                         aws_access_key_id=os.environ.get("access_key"),
                         aws_secret_access_key=os.environ.get("secret_access_key"))
-    bucket_name = os.environ.get("bucket_name")
-    file_name = "posts_data.json"
+    bucket = s3.Bucket(os.environ.get("bucket_name"))
 
-    print("Uploading file...")
-    s3.Bucket(bucket_name).put_object(
-        Key=file_name, Body=json.dumps(posts_data))
+    shards = [event] if event and event.get('subreddit') else SHARDS
+    keys = [extract_subreddit(reddit, bucket, shard['subreddit'], shard['num_posts'])
+            for shard in shards]
 
-    # Return the posts_data as the response
-
-    print("File uploaded.")
-    return "Sent data to S3."
+    report_startup()
+    return {'keys': keys}
@@ -0,0 +1,103 @@
+"""Script to compare the throughput of the spaCy extraction profiles against how closely
+their keywords agree with the full en_core_web_lg pipeline. With --sentiment, compares the
+throughput of the batched sentiment scorer against scoring each comment with Vader instead.
+
+Usage: python benchmark.py batch.jsonl.gz [number of texts] [--sentiment]"""
+import sys
+import gzip
+import json
+import time
+from typing import Iterator
+import spacy
+from app import SPACY_MODELS, NLP_BATCH_SIZE, load_nlp, find_keywords
+from sentiment import SentimentScorer, load_analyser
+
+REFERENCE_MODEL = "en_core_web_lg"
+
+
+def read_posts(file_path: str) -> Iterator[dict]:
+    """Yield the posts of a batch written by the extract script one at a time. Batches are
+    gzipped JSON lines, or a single JSON list for older .json files."""
+    if file_path.endswith('.json'):
+        with open(file_path, encoding='utf-8') as file:
+            yield from json.loads(file.read())
+        return
+    with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def load_corpus(file_path: str, limit: int = None, titles: bool = True) -> list[str]:
+    """Load the titles (unless titles is False) and comments of a batch written by the
+    extract script"""
+    texts = []
+    for post in read_posts(file_path):
+        if titles:
+            texts.append(post['title'].replace('/', ' or '))
+        texts.extend(comment['comment'] for comment in post['comments'])
+        if limit is not None and len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def extract_keywords(nlp, texts: list[str]) -> tuple[list[set], float]:
+    """Return the keywords found in each text, and the number of texts processed per second"""
+    start = time.perf_counter()
+    keywords = [set(find_keywords(doc, lowercase=True)[1])
+                for doc in nlp.pipe(texts, batch_size=NLP_BATCH_SIZE)]
+    return keywords, len(texts) / (time.perf_counter() - start)
+
+
+def agreement(keywords: list[set], reference: list[set]) -> float:
+    """Mean Jaccard similarity between the keywords of each text and the reference keywords"""
+    scores = [len(found & expected) / len(found | expected) if found | expected else 1.0
+              for found, expected in zip(keywords, reference)]
+    return sum(scores) / len(scores)
+
+
+def benchmark(texts: list[str]):
+    """Print the load time, throughput and keyword agreement of every installed profile"""
+    reference, reference_rate = extract_keywords(spacy.load(REFERENCE_MODEL), texts)
+    print(f"{len(texts)} texts, reference {REFERENCE_MODEL} (full pipeline): "
+          f"{reference_rate:.1f} texts/s")
+    print(f"{'model':<8}{'load (s)':>10}{'texts/s':>10}{'speedup':>10}{'agreement':>11}")
+
+    for model_size, model_name in SPACY_MODELS.items():
+        if not spacy.util.is_package(model_name):
+            print(f"{model_size:<8}{'not installed':>41}")
+            continue
+        start = time.perf_counter()
+        nlp = load_nlp(model_size)
+        load_time = time.perf_counter() - start
+
+        keywords, rate = extract_keywords(nlp, texts)
+        print(f"{model_size:<8}{load_time:>10.2f}{rate:>10.1f}"
+              f"{rate / reference_rate:>9.2f}x{agreement(keywords, reference):>11.3f}")
+
+
+def benchmark_sentiment(comments: list[str]):
+    """Print the throughput of Vader on each comment, and of the batched scorer with and
+    without its lexicon fast path, checking that every score is the same"""
+    sia = load_analyser()
+    start = time.perf_counter()
+    reference = [sia.polarity_scores(comment) for comment in comments]
+    reference_rate = len(comments) / (time.perf_counter() - start)
+    print(f"{len(comments)} comments ({len(set(comments))} distinct), "
+          f"Vader per comment: {reference_rate:.1f} comments/s")
+    print(f"{'scorer':<12}{'comments/s':>12}{'speedup':>10}{'same scores':>13}")
+
+    for name, fast_path in [("cache", False), ("cache+fast", True)]:
+        scorer = SentimentScorer(sia, fast_path=fast_path)
+        start = time.perf_counter()
+        scores = scorer.score_batch(comments)
+        rate = len(comments) / (time.perf_counter() - start)
+        print(f"{name:<12}{rate:>12.1f}{rate / reference_rate:>9.2f}x{str(scores == reference):>13}")
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--sentiment"]
+    limit = int(arguments[1]) if len(arguments) > 1 else None
+    if "--sentiment" in sys.argv:
+        benchmark_sentiment(load_corpus(arguments[0], limit, titles=False))
+    else:
+        benchmark(load_corpus(arguments[0], limit))
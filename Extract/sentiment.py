@@ -0,0 +1,87 @@
+"""Module for scoring the sentiment of comments with Vader in batches. Identical comments (bots,
+copypasta, "[deleted]") are only scored once, and comments without any word of the Vader
+lexicon are given their neutral score without running the analyser."""
+import os
+import string
+import hashlib
+from collections import OrderedDict
+from typing import Iterable
+import nltk
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+# The Vader lexicon is bundled with the Lambda image, under one of nltk's data directories.
+# Anywhere it is missing, e.g. when run locally, it is downloaded to DOWNLOAD_DIRECTORY.
+LEXICON_RESOURCE = "sentiment/vader_lexicon.zip"
+DOWNLOAD_DIRECTORY = "/tmp"
+# Number of distinct comments whose scores are kept between batches, and whether comments
+# without lexicon words skip the analyser
+SENTIMENT_CACHE_SIZE = int(os.environ.get("sentiment_cache_size", 100000))
+LEXICON_FAST_PATH = os.environ.get("sentiment_fast_path", "true").lower() == "true"
+# Vader's scores for text whose words all have no valence, and for text with no words at all
+NEUTRAL_SCORES = {'neg': 0.0, 'neu': 1.0, 'pos': 0.0, 'compound': 0.0}
+EMPTY_SCORES = {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compound': 0.0}
+
+
+def load_analyser() -> SentimentIntensityAnalyzer:
+    """Load Vader, only downloading its lexicon if no copy can be found"""
+    if DOWNLOAD_DIRECTORY not in nltk.data.path:
+        nltk.data.path.append(DOWNLOAD_DIRECTORY)
+    try:
+        nltk.data.find(LEXICON_RESOURCE)
+    except LookupError:
+        nltk.download("vader_lexicon", download_dir=DOWNLOAD_DIRECTORY)
+    return SentimentIntensityAnalyzer()
+
+
+def content_hash(text: str) -> bytes:
+    """Return the md5 digest of a text, the hash the loader deduplicates comments on"""
+    return hashlib.md5(text.encode('utf-8')).digest()
+
+
+class SentimentScorer:
+    """Scores texts like SentimentIntensityAnalyzer.polarity_scores, remembering the scores
+    of the most recently seen texts by their content hash."""
+
+    def __init__(self, analyser: SentimentIntensityAnalyzer = None,
+                 cache_size: int = SENTIMENT_CACHE_SIZE, fast_path: bool = LEXICON_FAST_PATH):
+        self.analyser = analyser or load_analyser()
+        self.lexicon = frozenset(self.analyser.lexicon)
+        self.cache_size = cache_size
+        self.fast_path = fast_path
+        self.cache = OrderedDict()
+
+    def has_no_valence(self, words: list[str]) -> bool:
+        """Whether none of the words can be in the lexicon. Vader strips a punctuation mark
+        from either end of a word before looking it up, so stripping all of them is safe."""
+        return not any(word in self.lexicon or word.strip(string.punctuation) in self.lexicon
+                       for word in words)
+
+    def polarity_scores(self, text: str) -> dict:
+        """Score a single text, without the cache"""
+        if self.fast_path:
+            # Vader ignores single characters, and only words in its lexicon have valence
+            words = [word.lower() for word in text.split() if len(word) > 1]
+            if not words:
+                return dict(EMPTY_SCORES)
+            if self.has_no_valence(words):
+                return dict(NEUTRAL_SCORES)
+        return self.analyser.polarity_scores(text)
+
+    def score_batch(self, texts: Iterable[str]) -> list[dict]:
+        """Return the scores of each text, scoring every distinct text at most once"""
+        texts = list(texts)
+        keys = [content_hash(text) for text in texts]
+        scores = {}
+        for key, text in zip(keys, texts):
+            if key in scores:
+                continue
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                scores[key] = self.cache[key]
+            else:
+                scores[key] = self.cache[key] = self.polarity_scores(text)
+
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        # Copy the scores, so changing those of one comment does not change the cache
+        return [dict(scores[key]) for key in keys]
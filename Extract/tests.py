@@ -5,7 +5,9 @@ from dotenv import load_dotenv
 import praw
 import spacy
 import unittest
-from app import fetch_posts, analyse_comments
+from app import fetch_posts, analyse_comments, parse_shards
+from sentiment import SentimentScorer, load_analyser
+from workers import WorkerPool
 
 
 # Load environment variables from .env file
@@ -175,3 +177,88 @@ class AnalyseCommentsTestCase(unittest.TestCase):
         self.assertIn('pos', post_data['comments'][0]['sentiment'])
         self.assertIn('neg', post_data['comments'][0]['sentiment'])
         self.assertIn('neu', post_data['comments'][0]['sentiment'])
+
+
+class IncrementalFetchTestCase(unittest.TestCase):
+    """class used for checkpointed fetch tests"""
+    def setUp(self):
+        """Mock praw.Reddit object returning a single hot post, also used by the fetching threads"""
+        self.reddit = MagicMock()
+        post = MagicMock()
+        post.id = 'abc123'
+        post.title = 'Sample Post'
+        post.created_utc = 1684929600
+        self.reddit.subreddit.return_value.hot.return_value = [post]
+        create_reddit = patch('app.create_reddit', return_value=self.reddit)
+        create_reddit.start()
+        self.addCleanup(create_reddit.stop)
+
+    @staticmethod
+    def mock_comment(comment_id: str, created_utc: int) -> MagicMock:
+        """Mock praw.models.Comment object"""
+        comment = MagicMock()
+        comment.id = comment_id
+        comment.body = f"Comment {comment_id}"
+        comment.created_utc = created_utc
+        return comment
+
+    @patch('app.praw.models')
+    def test_fetch_posts_only_returns_new_comments(self, mock_models):
+        """Comments recorded in the checkpoint should not be analysed again"""
+        comments = mock_models.Submission.return_value.comments.list
+        comments.return_value = [self.mock_comment('c1', 1684929700)]
+        checkpoint = {}
+
+        posts = fetch_posts(self.reddit, checkpoint=checkpoint)
+        self.assertEqual(len(posts[0]['comments']), 1)
+        self.assertEqual(checkpoint['abc123']['seen'], ['c1'])
+
+        # No new comments, so the post is left out
+        self.assertEqual(fetch_posts(self.reddit, checkpoint=checkpoint), [])
+
+        comments.return_value.append(self.mock_comment('c2', 1684929800))
+        posts = fetch_posts(self.reddit, checkpoint=checkpoint)
+        self.assertEqual([comment['id'] for comment in posts[0]['comments']], ['c2'])
+
+
+class SentimentScorerTestCase(unittest.TestCase):
+    """class used for batched sentiment scoring tests"""
+    TEXTS = ["I love using Reddit. It's great!", "[deleted]", "", "a", "Q3 results are out",
+             "NOT bad, kind of good :)", "This is the shit!!!", "why??", "[deleted]", "'good'"]
+
+    def test_score_batch_matches_vader(self):
+        """Batched scores should be the same as scoring each text with Vader"""
+        sia = load_analyser()
+        self.assertEqual(SentimentScorer(sia).score_batch(self.TEXTS),
+                         [sia.polarity_scores(text) for text in self.TEXTS])
+
+    def test_score_batch_scores_repeated_texts_once(self):
+        """Texts already scored should not be passed to Vader again"""
+        scorer = SentimentScorer(fast_path=False)
+        with patch.object(scorer.analyser, 'polarity_scores',
+                          wraps=scorer.analyser.polarity_scores) as polarity_scores:
+            scorer.score_batch(self.TEXTS)
+            scorer.score_batch(self.TEXTS)
+        self.assertEqual(polarity_scores.call_count, len(set(self.TEXTS)))
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    """class used for worker process tests"""
+    def test_map_returns_results_in_order(self):
+        """Batches analysed by different workers should be merged back in order"""
+        pool = WorkerPool(3)
+        batches = [[i, -i, i % 4] for i in range(20)]
+        self.assertEqual(list(pool.map(sorted, batches)), [sorted(batch) for batch in batches])
+        with self.assertRaises(ValueError):
+            list(pool.map(max, [[1], []]))
+        pool.close()
+
+
+class ParseShardsTestCase(unittest.TestCase):
+    """class used for subreddit shard parsing tests"""
+    @patch('app.NUM_POSTS', '25')
+    def test_parse_shards(self):
+        """Each subreddit should become a shard, defaulting to num_posts when none is given"""
+        self.assertEqual(parse_shards("technology:50, worldnews"),
+                         [{'subreddit': 'technology', 'num_posts': 50},
+                          {'subreddit': 'worldnews', 'num_posts': 25}])
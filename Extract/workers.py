@@ -0,0 +1,75 @@
+"""Module for running the extraction's NLP across several processes. Workers are forked once
+the models are loaded, so each shares the parent's copy rather than loading its own."""
+import multiprocessing
+from typing import Callable, Iterable, Iterator
+
+
+def run_worker(connection):
+    """Apply each function sent by the parent to its batch, and send back the result (or the
+    error raised) until the parent sends None"""
+    while (task := connection.recv()) is not None:
+        function, batch = task
+        try:
+            result = function(batch)
+        except Exception as error:
+            result = error
+        connection.send(result)
+
+
+class WorkerPool:
+    """Forked worker processes, each sent one batch at a time over its own pipe. Lambda has
+    no /dev/shm, which multiprocessing's pools and queues need, but pipes work there.
+    A pool of one process runs every batch in the calling process instead."""
+
+    def __init__(self, processes: int):
+        self.connections = []
+        if processes <= 1:
+            return
+        context = multiprocessing.get_context("fork")
+        for _ in range(processes):
+            connection, worker_connection = context.Pipe()
+            context.Process(target=run_worker, args=(worker_connection,), daemon=True).start()
+            worker_connection.close()
+            self.connections.append(connection)
+
+    def map(self, function: Callable, batches: Iterable[list]) -> Iterator:
+        """Yield the result of the function on each batch, in the order of the batches.
+        Batches are handed to the workers in turn, and each worker has at most one batch
+        at a time, so a worker sending back a large result can never block on the parent."""
+        if not self.connections:
+            yield from map(function, batches)
+            return
+
+        num_sent = num_received = 0
+        try:
+            for batch in batches:
+                connection = self.connections[num_sent % len(self.connections)]
+                if num_sent - num_received == len(self.connections):
+                    # This worker has the oldest batch still outstanding
+                    num_received += 1
+                    yield self.receive(connection)
+                connection.send((function, batch))
+                num_sent += 1
+            while num_received < num_sent:
+                num_received += 1
+                yield self.receive(self.connections[(num_received - 1) % len(self.connections)])
+        finally:
+            # If the results stop being read part way, discard those still to come so that
+            # the next map does not receive them
+            for position in range(num_received, num_sent):
+                self.connections[position % len(self.connections)].recv()
+
+    @staticmethod
+    def receive(connection):
+        """Return the result sent back by a worker, raising the error if it failed"""
+        result = connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        """Stop the worker processes"""
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        self.connections = []
@@ -0,0 +1,42 @@
+"""Script to label the post keywords loaded before labels were recorded, using the cache of
+entity labels the dashboard used to keep in S3.
+
+Usage: python backfill_labels.py"""
+import os
+import json
+from psycopg2.extras import execute_values
+import boto3
+from load import PAGE_SIZE, get_connection
+
+CACHE_KEY = "cache.json"
+
+
+def load_label_cache(bucket) -> dict[str, str]:
+    """Return the keyword to entity label cache stored in the bucket"""
+    return json.loads(bucket.Object(CACHE_KEY).get()['Body'].read())
+
+
+def backfill_labels(cursor, labels: dict[str, str]) -> int:
+    """Set the label of each unlabelled post keyword found in the cache. Returns the number
+    of keywords labelled."""
+    items = list(labels.items())
+    num_labelled = 0
+    for start in range(0, len(items), PAGE_SIZE):
+        execute_values(cursor, """UPDATE Post_keyword pk SET label = cached.label
+                                  FROM (VALUES %s) AS cached (post_keyword, label)
+                                  WHERE pk.post_keyword = cached.post_keyword
+                                  AND pk.label IS NULL""",
+                       items[start:start + PAGE_SIZE], page_size=PAGE_SIZE)
+        num_labelled += cursor.rowcount
+    return num_labelled
+
+
+if __name__ == "__main__":
+    s3 = boto3.resource(service_name='s3', region_name=os.environ.get("region_name"),
+                        aws_access_key_id=os.environ.get("access_key"),
+                        aws_secret_access_key=os.environ.get("secret_access_key"))
+    connection = get_connection()
+    with connection, connection.cursor() as cursor:
+        labels = load_label_cache(s3.Bucket(os.environ.get("bucket_name")))
+        print(f"Labelled {backfill_labels(cursor, labels)} of {len(labels)} cached keywords.")
+    connection.close()
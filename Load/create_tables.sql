@@ -1,13 +1,16 @@
 CREATE TABLE IF NOT EXISTS Post (
     post_id INT GENERATED ALWAYS AS IDENTITY,
+    reddit_id VARCHAR(10),
     post_time TIMESTAMP NOT NULL,
     title varchar(300) NOT NULL,
+    content_hash UUID GENERATED ALWAYS AS (md5(title)::uuid) STORED,
     PRIMARY KEY (post_id)
 );
 
 CREATE TABLE IF NOT EXISTS Post_keyword (
     post_keyword_id INT GENERATED ALWAYS AS IDENTITY,
     post_keyword VARCHAR(50) NOT NULL UNIQUE,
+    label VARCHAR(20),
     PRIMARY KEY (post_keyword_id)
 );
 
@@ -26,6 +29,8 @@ CREATE TABLE IF NOT EXISTS Comment (
     score INT NOT NULL,
     sentiment FLOAT NOT NULL,
     post_id INT NOT NULL,
+    reddit_id VARCHAR(10),
+    content_hash UUID GENERATED ALWAYS AS (md5(comment)::uuid) STORED,
     FOREIGN KEY (post_id) REFERENCES Post(post_id),
     PRIMARY KEY (comment_id)
 );
@@ -42,4 +47,93 @@ CREATE TABLE IF NOT EXISTS Keyword_in_comment (
     FOREIGN KEY (comment_id) REFERENCES Comment(comment_id),
     FOREIGN KEY (comment_keyword_id) REFERENCES Comment_keyword(comment_keyword_id),
     UNIQUE (comment_id, comment_keyword_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS Keyword_sentiment_daily (
+    day DATE NOT NULL,
+    post_keyword_id INT NOT NULL,
+    sentiment_sum FLOAT NOT NULL,
+    comment_count INT NOT NULL,
+    score_sum BIGINT NOT NULL,
+    FOREIGN KEY (post_keyword_id) REFERENCES Post_keyword(post_keyword_id),
+    PRIMARY KEY (day, post_keyword_id)
+);
+
+CREATE TABLE IF NOT EXISTS Post_comment_daily (
+    day DATE NOT NULL,
+    post_id INT NOT NULL,
+    comment_count INT NOT NULL,
+    FOREIGN KEY (post_id) REFERENCES Post(post_id),
+    PRIMARY KEY (day, post_id)
+);
+
+CREATE TABLE IF NOT EXISTS Loaded_batch (
+    batch_key VARCHAR(300) NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    new_posts INT,
+    new_comments INT,
+    PRIMARY KEY (batch_key)
+);
+
+-- Add the natural keys and keyword labels to tables created before they existed. The catalog
+-- is checked first, so the ALTER TABLE lock is only taken by the run that migrates.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'post' AND column_name = 'reddit_id') THEN
+        ALTER TABLE Post ADD COLUMN reddit_id VARCHAR(10);
+        ALTER TABLE Post ADD COLUMN content_hash UUID GENERATED ALWAYS AS (md5(title)::uuid) STORED;
+        ALTER TABLE Comment ADD COLUMN reddit_id VARCHAR(10);
+        ALTER TABLE Comment ADD COLUMN content_hash UUID GENERATED ALWAYS AS (md5(comment)::uuid) STORED;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'post_keyword' AND column_name = 'label') THEN
+        ALTER TABLE Post_keyword ADD COLUMN label VARCHAR(20);
+    END IF;
+END $$;
+
+-- Posts and comments are deduplicated on their Reddit id and on a hash of their text, and the
+-- rest of the indexes serve the dashboard's queries, which filter comments by time and join
+-- on keywords. CREATE INDEX IF NOT EXISTS locks its table before checking whether the index
+-- exists, which would make each load wait for the others to commit, so pg_indexes is
+-- checked first.
+DO $$
+DECLARE
+    wanted RECORD;
+BEGIN
+    FOR wanted IN SELECT * FROM (VALUES
+        ('post_reddit_id_idx', 'CREATE UNIQUE INDEX post_reddit_id_idx ON Post (reddit_id)'),
+        ('post_content_hash_idx', 'CREATE UNIQUE INDEX post_content_hash_idx ON Post (content_hash)'),
+        ('comment_reddit_id_idx', 'CREATE UNIQUE INDEX comment_reddit_id_idx ON Comment (reddit_id)'),
+        ('comment_content_hash_idx', 'CREATE UNIQUE INDEX comment_content_hash_idx ON Comment (content_hash)'),
+        ('comment_time_idx', 'CREATE INDEX comment_time_idx ON Comment (comment_time)'),
+        ('comment_post_id_idx', 'CREATE INDEX comment_post_id_idx ON Comment (post_id)'),
+        ('keyword_in_post_keyword_idx', 'CREATE INDEX keyword_in_post_keyword_idx ON Keyword_in_post (post_keyword_id)'),
+        ('keyword_sentiment_daily_keyword_idx',
+         'CREATE INDEX keyword_sentiment_daily_keyword_idx ON Keyword_sentiment_daily (post_keyword_id, day)')
+    ) AS indexes (name, definition)
+    LOOP
+        IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = wanted.name) THEN
+            EXECUTE wanted.definition;
+        END IF;
+    END LOOP;
+END $$;
+
+-- Build the daily rollups from the existing comments the first time they are created.
+-- After that, the loader keeps it up to date as each batch is committed.
+INSERT INTO Keyword_sentiment_daily (day, post_keyword_id, sentiment_sum, comment_count, score_sum)
+SELECT c.comment_time::date, kp.post_keyword_id, SUM(c.sentiment), COUNT(*), SUM(c.score)
+FROM Comment c
+JOIN Keyword_in_post kp USING (post_id)
+WHERE EXISTS (SELECT 1 FROM Keyword_in_comment kc WHERE kc.comment_id = c.comment_id)
+AND NOT EXISTS (SELECT 1 FROM Keyword_sentiment_daily)
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO Post_comment_daily (day, post_id, comment_count)
+SELECT c.comment_time::date, c.post_id, COUNT(*)
+FROM Comment c
+WHERE EXISTS (SELECT 1 FROM Keyword_in_comment kc WHERE kc.comment_id = c.comment_id)
+AND NOT EXISTS (SELECT 1 FROM Post_comment_daily)
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
@@ -2,7 +2,12 @@
 create_tables.sql file"""
 import os
 import json
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
 import boto3
 
 DB_HOST = os.environ.get('DB_HOST')
@@ -10,101 +15,374 @@ DB_PORT = int(os.environ.get('DB_PORT'))
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
-FILE_NAME = "posts_data.json"
+# Batches written by the extract script, each announced by a manifest once complete
+BATCH_PREFIX = "batches/"
+MANIFEST_PREFIX = "manifests/"
+# Number of batches loaded at the same time, and attempts made when a load deadlocks
+LOAD_WORKERS = int(os.environ.get('LOAD_WORKERS', 2))
+LOAD_ATTEMPTS = 3
 SQL_FILEPATH = "/var/task/create_tables.sql"
+MAX_KEYWORD_LENGTH = 50
+# Number of rows sent to the staging tables per INSERT statement, and the number of
+# posts buffered before their rows are sent
+PAGE_SIZE = 1000
+STAGE_CHUNK_SIZE = 100
 
+# Temporary tables holding one batch of extracted data. post_ref and comment_ref number
+# the posts and comments of the batch, and are used to join the staged rows together.
+CREATE_STAGING_TABLES = """
+CREATE TEMP TABLE staged_post (
+    post_ref INT NOT NULL,
+    reddit_id VARCHAR(10),
+    post_time TIMESTAMP NOT NULL,
+    title VARCHAR(300) NOT NULL,
+    content_hash UUID GENERATED ALWAYS AS (md5(title)::uuid) STORED,
+    post_id INT,
+    is_first BOOLEAN NOT NULL DEFAULT FALSE,
+    is_new BOOLEAN NOT NULL DEFAULT FALSE
+) ON COMMIT DROP;
 
-def lambda_handler(event, context):
-    """Lambda handler to take data from a csv, set up a postgres db
-    if necessary, and transfer in non-pre-existing data."""
-    # Establish database connection
-    connection = psycopg2.connect(
+CREATE TEMP TABLE staged_post_keyword (
+    post_ref INT NOT NULL,
+    post_keyword VARCHAR(50) NOT NULL,
+    label VARCHAR(20)
+) ON COMMIT DROP;
+
+CREATE TEMP TABLE staged_comment (
+    comment_ref INT NOT NULL,
+    post_ref INT NOT NULL,
+    reddit_id VARCHAR(10),
+    comment_time TIMESTAMP NOT NULL,
+    comment VARCHAR(10000) NOT NULL,
+    content_hash UUID GENERATED ALWAYS AS (md5(comment)::uuid) STORED,
+    score INT NOT NULL,
+    sentiment FLOAT NOT NULL,
+    comment_id INT,
+    is_first BOOLEAN NOT NULL DEFAULT FALSE,
+    is_new BOOLEAN NOT NULL DEFAULT FALSE
+) ON COMMIT DROP;
+
+CREATE TEMP TABLE staged_comment_keyword (
+    comment_ref INT NOT NULL,
+    comment_keyword VARCHAR(50) NOT NULL
+) ON COMMIT DROP;
+"""
+
+STAGING_INSERTS = {
+    'staged_post': "INSERT INTO staged_post (post_ref, reddit_id, post_time, title) VALUES %s",
+    'staged_post_keyword': """INSERT INTO staged_post_keyword (post_ref, post_keyword, label)
+                              VALUES %s""",
+    'staged_comment': """INSERT INTO staged_comment (comment_ref, post_ref, reddit_id,
+                         comment_time, comment, score, sentiment) VALUES %s""",
+    'staged_comment_keyword': """INSERT INTO staged_comment_keyword (comment_ref, comment_keyword)
+                                 VALUES %s"""
+}
+
+# Set-based statements moving the staged batch into the real tables, run in order.
+# Posts and comments are deduplicated with ON CONFLICT against the unique indexes on
+# their Reddit id and content hash. As with the previous row-by-row loader, only the
+# first copy of a duplicate is inserted, and keywords are only attached to new rows.
+# Rows are inserted in index order, so that batches loaded concurrently lock them in
+# the same order rather than deadlocking.
+RESOLVE_STATEMENTS = [
+    # Insert the first staged copy of each post, skipping those that already exist
+    """
+    UPDATE staged_post SET is_first = TRUE
+    WHERE post_ref IN (
+        SELECT DISTINCT ON (content_hash) post_ref
+        FROM staged_post
+        ORDER BY content_hash, post_ref
+    );
+    """,
+    """
+    WITH new_post AS (
+        INSERT INTO Post (reddit_id, post_time, title)
+        SELECT reddit_id, post_time, title FROM staged_post WHERE is_first ORDER BY content_hash
+        ON CONFLICT DO NOTHING
+        RETURNING post_id, content_hash
+    )
+    UPDATE staged_post s SET post_id = new_post.post_id, is_new = s.is_first
+    FROM new_post
+    WHERE s.content_hash = new_post.content_hash;
+    """,
+    # Find the ids of the posts that already existed
+    """
+    UPDATE staged_post s SET post_id = p.post_id
+    FROM Post p
+    WHERE s.post_id IS NULL
+    AND (p.content_hash = s.content_hash OR p.reddit_id = s.reddit_id);
+    """,
+    # Insert the keywords of new posts with their most common entity label, and link them
+    # to the posts. Keywords recorded without a label are given one once it is known.
+    """
+    INSERT INTO Post_keyword AS pk (post_keyword, label)
+    SELECT DISTINCT ON (k.post_keyword) k.post_keyword, k.label
+    FROM staged_post_keyword k
+    JOIN staged_post s USING (post_ref)
+    WHERE s.is_new
+    GROUP BY k.post_keyword, k.label
+    ORDER BY k.post_keyword, k.label IS NULL, COUNT(*) DESC, k.label
+    ON CONFLICT (post_keyword) DO UPDATE SET label = EXCLUDED.label
+    WHERE pk.label IS NULL AND EXCLUDED.label IS NOT NULL;
+    """,
+    """
+    INSERT INTO Keyword_in_post (post_id, post_keyword_id)
+    SELECT DISTINCT s.post_id, pk.post_keyword_id
+    FROM staged_post_keyword k
+    JOIN staged_post s USING (post_ref)
+    JOIN Post_keyword pk USING (post_keyword)
+    WHERE s.is_new
+    ON CONFLICT DO NOTHING;
+    """,
+    # Insert the first staged copy of each comment, skipping those that already exist
+    """
+    UPDATE staged_comment SET is_first = TRUE
+    WHERE comment_ref IN (
+        SELECT DISTINCT ON (content_hash) comment_ref
+        FROM staged_comment
+        ORDER BY content_hash, comment_ref
+    );
+    """,
+    """
+    WITH new_comment AS (
+        INSERT INTO Comment (reddit_id, comment_time, comment, score, sentiment, post_id)
+        SELECT c.reddit_id, c.comment_time, c.comment, c.score, c.sentiment, s.post_id
+        FROM staged_comment c
+        JOIN staged_post s USING (post_ref)
+        WHERE c.is_first
+        ORDER BY c.content_hash
+        ON CONFLICT DO NOTHING
+        RETURNING comment_id, content_hash
+    )
+    UPDATE staged_comment c SET comment_id = new_comment.comment_id, is_new = TRUE
+    FROM new_comment
+    WHERE c.is_first AND c.content_hash = new_comment.content_hash;
+    """,
+    # Insert the keywords of new comments, and link them to the comments
+    """
+    INSERT INTO Comment_keyword (comment_keyword)
+    SELECT DISTINCT k.comment_keyword
+    FROM staged_comment_keyword k
+    JOIN staged_comment c USING (comment_ref)
+    WHERE c.is_new
+    ORDER BY k.comment_keyword
+    ON CONFLICT (comment_keyword) DO NOTHING;
+    """,
+    """
+    INSERT INTO Keyword_in_comment (comment_id, comment_keyword_id)
+    SELECT DISTINCT c.comment_id, ck.comment_keyword_id
+    FROM staged_comment_keyword k
+    JOIN staged_comment c USING (comment_ref)
+    JOIN Comment_keyword ck USING (comment_keyword)
+    WHERE c.is_new
+    ON CONFLICT DO NOTHING;
+    """,
+    # Add the new comments to the daily sentiment of their posts' keywords. Like the
+    # dashboard's joined frame, only comments with at least one keyword are counted.
+    """
+    INSERT INTO Keyword_sentiment_daily AS d
+        (day, post_keyword_id, sentiment_sum, comment_count, score_sum)
+    SELECT c.comment_time::date, kp.post_keyword_id, SUM(c.sentiment), COUNT(*), SUM(c.score)
+    FROM staged_comment c
+    JOIN staged_post s USING (post_ref)
+    JOIN Keyword_in_post kp ON kp.post_id = s.post_id
+    WHERE c.is_new
+    AND EXISTS (SELECT 1 FROM staged_comment_keyword k WHERE k.comment_ref = c.comment_ref)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, post_keyword_id) DO UPDATE SET
+        sentiment_sum = d.sentiment_sum + EXCLUDED.sentiment_sum,
+        comment_count = d.comment_count + EXCLUDED.comment_count,
+        score_sum = d.score_sum + EXCLUDED.score_sum;
+    """,
+    # Add the new comments to the daily comment count of their posts, counted the same way
+    """
+    INSERT INTO Post_comment_daily AS d (day, post_id, comment_count)
+    SELECT c.comment_time::date, s.post_id, COUNT(*)
+    FROM staged_comment c
+    JOIN staged_post s USING (post_ref)
+    WHERE c.is_new
+    AND EXISTS (SELECT 1 FROM staged_comment_keyword k WHERE k.comment_ref = c.comment_ref)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, post_id) DO UPDATE SET
+        comment_count = d.comment_count + EXCLUDED.comment_count;
+    """
+]
+
+
+def read_batch(body, key: str) -> Iterator[dict]:
+    """Yield the posts of an extracted object one at a time, streamed from its S3 body.
+    Objects are gzipped JSON lines, or a single JSON list for older .json objects."""
+    if key.endswith('.json'):
+        yield from json.loads(body.read())
+        return
+    with gzip.GzipFile(fileobj=body) as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def flush_staged_rows(cursor, rows: dict[str, list]):
+    """Send the buffered rows of each staging table to the database"""
+    for table, table_rows in rows.items():
+        execute_values(cursor, STAGING_INSERTS[table], table_rows, page_size=PAGE_SIZE)
+        table_rows.clear()
+
+
+def stage_batch(cursor, data: Iterable[dict]):
+    """Copy a batch of extracted posts into the staging tables, a chunk of posts at a time"""
+    rows = {table: [] for table in STAGING_INSERTS}
+    num_posts, num_comments = 0, 0
+
+    for post_ref, post in enumerate(data):
+        rows['staged_post'].append((post_ref, post.get('id'), post['datetime'], post['title']))
+        # Keywords that are entities take the entity's label, adjectives have none
+        labels = {}
+        for text, label in post.get('entities', []):
+            labels.setdefault(text, label)
+        rows['staged_post_keyword'].extend((post_ref, keyword, labels.get(keyword))
+                                           for keyword in post['keywords']
+                                           if len(keyword) <= MAX_KEYWORD_LENGTH)
+
+        for comment in post['comments']:
+            comment_ref = num_comments
+            num_comments += 1
+            rows['staged_comment'].append((comment_ref, post_ref, comment.get('id'),
+                                           comment['datetime'], comment['comment'],
+                                           comment['score'], comment['sentiment']['compound']))
+            rows['staged_comment_keyword'].extend(
+                (comment_ref, keyword) for keyword in comment['keywords']
+                if len(keyword) <= MAX_KEYWORD_LENGTH)
+
+        num_posts += 1
+        if num_posts % STAGE_CHUNK_SIZE == 0:
+            flush_staged_rows(cursor, rows)
+
+    flush_staged_rows(cursor, rows)
+    print(f"Staged {num_posts} posts and {num_comments} comments.")
+
+
+def load_batch(cursor, data: Iterable[dict]) -> tuple[int, int]:
+    """Insert the non-pre-existing posts, comments and keywords of a batch, using a
+    fixed number of statements regardless of the size of the batch.
+    Returns the number of new posts and comments."""
+    cursor.execute(CREATE_STAGING_TABLES)
+    stage_batch(cursor, data)
+    for statement in RESOLVE_STATEMENTS:
+        cursor.execute(statement)
+
+    cursor.execute("""SELECT (SELECT COUNT(*) FROM staged_post WHERE is_new),
+                      (SELECT COUNT(*) FROM staged_comment WHERE is_new)""")
+    return cursor.fetchone()
+
+
+def get_connection():
+    """Establish a database connection"""
+    return psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD
     )
+
+
+def get_bucket():
+    """Create a resource for the bucket of extracted batches. boto3 resources are not thread
+    safe, so each thread loading batches creates its own, from its own session."""
+    s3 = boto3.session.Session().resource(
+        service_name='s3', region_name=os.environ.get("region_name"),
+        aws_access_key_id=os.environ.get("access_key"),
+        aws_secret_access_key=os.environ.get("secret_access_key"))
+    return s3.Bucket(os.environ.get("bucket_name"))
+
+
+def manifest_key(batch_key: str) -> str:
+    """Return the key of the manifest announcing a batch"""
+    batch_id = batch_key.removeprefix(BATCH_PREFIX).removesuffix(".jsonl.gz")
+    return f"{MANIFEST_PREFIX}{batch_id}.json"
+
+
+def pending_batches(bucket, cursor) -> list[str]:
+    """Return the keys of the announced batches that have not been loaded yet, oldest first"""
+    keys = [json.loads(manifest.get()['Body'].read())['key']
+            for manifest in bucket.objects.filter(Prefix=MANIFEST_PREFIX)]
+    cursor.execute("SELECT batch_key FROM Loaded_batch WHERE batch_key = ANY(%s)", (keys,))
+    loaded = {row[0] for row in cursor.fetchall()}
+    # Batches whose manifest outlived the load are loaded, so their manifests are tidied up
+    for key in loaded:
+        bucket.Object(manifest_key(key)).delete()
+    return sorted((key for key in keys if key not in loaded), key=batch_order)
+
+
+def batch_order(key: str) -> str:
+    """Sort key putting batches in the order they were extracted, named by their time"""
+    return key.rsplit("/", 1)[-1]
+
+
+def keys_to_load(event, bucket, cursor) -> list[str]:
+    """Return the keys of the batches listed by the event, along with every other announced
+    batch not loaded yet (e.g. one whose load failed before), without repeats, oldest first"""
+    keys = set(event.get('keys') or []) if event else set()
+    keys.update(pending_batches(bucket, cursor))
+    return sorted(keys, key=batch_order)
+
+
+def load_object(key: str) -> bool:
+    """Load one batch object in its own transaction, unless it has already been loaded.
+    The batch is recorded in Loaded_batch by the same transaction, so it is committed
+    exactly once even when several loads race for it. Returns whether it was loaded."""
+    bucket = get_bucket()
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        for attempt in range(1, LOAD_ATTEMPTS + 1):
+            try:
+                cursor.execute("""INSERT INTO Loaded_batch (batch_key) VALUES (%s)
+                               ON CONFLICT DO NOTHING RETURNING batch_key""", (key,))
+                if cursor.fetchone() is None:
+                    print(f"Skipping {key}, it has already been loaded.")
+                    connection.rollback()
+                    return False
+
+                print(f"Loading {key}...")
+                body = bucket.Object(key).get()['Body']
+                new_posts, new_comments = load_batch(cursor, read_batch(body, key))
+                cursor.execute("""UPDATE Loaded_batch SET new_posts = %s, new_comments = %s
+                               WHERE batch_key = %s""", (new_posts, new_comments, key))
+                connection.commit()
+                print(f"Loaded {new_posts} new posts and {new_comments} new comments from {key}.")
+                break
+            except psycopg2.errors.DeadlockDetected:
+                connection.rollback()
+                if attempt == LOAD_ATTEMPTS:
+                    raise
+                print(f"Deadlock while loading {key}, retrying...")
+    finally:
+        cursor.close()
+        connection.close()
+
+    if key.startswith(BATCH_PREFIX):
+        bucket.Object(manifest_key(key)).delete()
+    return True
+
+
+def lambda_handler(event, context):
+    """Lambda handler to take extracted batches from S3, set up a postgres db
+    if necessary, and transfer in non-pre-existing data. The event may list the
+    keys of the batches to load ({"keys": [...]}), as returned by the extract step.
+    Every other announced batch that has not been loaded yet is loaded as well, so that
+    batches whose load failed are retried by the next run."""
+    connection = get_connection()
     cursor = connection.cursor()
     cursor.execute(open(SQL_FILEPATH, "r").read())
-    s3 = boto3.resource(service_name='s3', region_name=os.environ.get("region_name"),
-                        aws_access_key_id=os.environ.get("access_key"),
-                        aws_secret_access_key=os.environ.get("secret_access_key"))
-
-    bucket_name = os.environ.get("bucket_name")
-    s3.Bucket(bucket_name).download_file(FILE_NAME, f'/tmp/{FILE_NAME}')
-
-    with open(f'/tmp/{FILE_NAME}', encoding='utf-8') as file:
-        data = json.loads(file.read())
-
-    # Process each post in the json input
-    for post in data:
-        # Check if post exists in the database based on title
-        cursor.execute(
-            "SELECT post_id FROM Post WHERE title = %s", (post['title'],))
-        post_id = cursor.fetchone()
-
-        if not post_id:
-            # Insert the new post into the database
-            cursor.execute("INSERT INTO Post (post_time, title) VALUES (%s, %s) RETURNING post_id",
-                           (post['datetime'], post['title']))
-            post_id = cursor.fetchone()[0]
-
-            # Insert keywords associated with the post
-            for keyword in post['keywords']:
-                if len(keyword) > 50:
-                    continue
-                cursor.execute(
-                    "SELECT post_keyword_id FROM Post_keyword WHERE post_keyword = %s", (keyword,))
-                keyword_id = cursor.fetchone()
-
-                if not keyword_id:
-                    # Insert new keyword into the database
-                    cursor.execute("INSERT INTO Post_keyword (post_keyword) VALUES (%s) RETURNING post_keyword_id",
-                                   (keyword,))
-                    keyword_id = cursor.fetchone()[0]
-
-                # Insert the relationship between post and keyword
-                cursor.execute("INSERT INTO Keyword_in_post (post_id, post_keyword_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                               (post_id, keyword_id))
-
-        # Process comments
-        for comment in post['comments']:
-            # Check if comment exists in the database based on comment text
-            cursor.execute(
-                "SELECT comment_id FROM Comment WHERE comment = %s", (comment['comment'],))
-            comment_id = cursor.fetchone()
-
-            if comment_id:
-                continue  # Skip this comment if it already exists
-
-            # Insert the new comment into the database
-            cursor.execute("INSERT INTO Comment (comment_time, comment, score, sentiment, post_id) VALUES (%s, %s, %s, %s, %s) RETURNING comment_id",
-                           (comment['datetime'], comment['comment'], comment['score'],
-                            comment['sentiment']['compound'], post_id))
-            comment_id = cursor.fetchone()[0]
-
-            # Insert keywords associated with the comment
-            for keyword in comment['keywords']:
-                if len(keyword) > 50:
-                    continue
-                cursor.execute(
-                    "SELECT comment_keyword_id FROM Comment_keyword WHERE comment_keyword = %s", (keyword,))
-                keyword_id = cursor.fetchone()
-
-                if not keyword_id:
-                    # Insert new keyword into the database
-                    cursor.execute("INSERT INTO Comment_keyword (comment_keyword) VALUES (%s) RETURNING comment_keyword_id",
-                                   (keyword,))
-                    keyword_id = cursor.fetchone()[0]
-
-                # Insert the relationship between comment and keyword
-                cursor.execute("INSERT INTO Keyword_in_comment (comment_id, comment_keyword_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                               (comment_id, keyword_id))
-
-    # Commit the changes and close the connection
     connection.commit()
+    keys = keys_to_load(event, get_bucket(), cursor)
     cursor.close()
     connection.close()
 
-    return "Data processed successfully"
+    # Independent batches are loaded in parallel, each with its own connection
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        loaded = sum(executor.map(load_object, keys))
+
+    return f"Data processed successfully, loaded {loaded} of {len(keys)} batches"
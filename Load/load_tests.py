@@ -1,8 +1,13 @@
 """Test file for the load.py script"""
 import os
+import io
+import gzip
+import json
 import unittest
+from unittest.mock import MagicMock
 import psycopg2
-from load import lambda_handler
+from load import (lambda_handler, load_batch, read_batch, manifest_key, pending_batches,
+                  keys_to_load)
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -37,7 +42,7 @@ class TestLoad(unittest.TestCase):
             raise ValueError("Testing on the production db!")
         # Clean up database
         self.cursor.execute(
-            "DROP TABLE IF EXISTS Post, Post_keyword, Keyword_in_post, Comment, Comment_keyword, Keyword_in_comment")
+            "DROP TABLE IF EXISTS Post, Post_keyword, Keyword_in_post, Comment, Comment_keyword, Keyword_in_comment, Keyword_sentiment_daily, Post_comment_daily, Loaded_batch")
         self.conn.commit()
         self.cursor.close()
         self.conn.close()
@@ -57,6 +62,94 @@ class TestLoad(unittest.TestCase):
         comments = self.cursor.fetchall()
         self.assertTrue(len(comments) > 0)
 
+    def test_load_batch_skips_existing_rows(self):
+        """Loading the same batch twice should not duplicate any rows"""
+        with open(os.path.join(os.path.dirname(__file__), "create_tables.sql"),
+                  encoding='utf-8') as sql_file:
+            self.cursor.execute(sql_file.read())
+
+        load_batch(self.cursor, self.test_data)
+        self.conn.commit()
+        load_batch(self.cursor, self.test_data)
+        self.conn.commit()
+
+        for table in ["Post", "Post_keyword", "Keyword_in_post",
+                      "Comment", "Comment_keyword", "Keyword_in_comment"]:
+            self.cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            self.assertEqual(self.cursor.fetchone()[0], 1)
+
+        self.cursor.execute("SELECT comment_count, sentiment_sum FROM Keyword_sentiment_daily")
+        self.assertEqual(self.cursor.fetchall(), [(1, 1.0)])
+        self.cursor.execute("SELECT comment_count FROM Post_comment_daily")
+        self.assertEqual(self.cursor.fetchall(), [(1,)])
+
+    def test_load_batch_labels_keywords(self):
+        """Post keywords should be stored with the label of the entity they came from"""
+        with open(os.path.join(os.path.dirname(__file__), "create_tables.sql"),
+                  encoding='utf-8') as sql_file:
+            self.cursor.execute(sql_file.read())
+        self.test_data[0]["keywords"].append("Apple")
+        self.test_data[0]["entities"] = [["Apple", "ORG"]]
+
+        load_batch(self.cursor, self.test_data)
+        self.conn.commit()
+
+        self.cursor.execute("SELECT post_keyword, label FROM Post_keyword ORDER BY post_keyword")
+        self.assertEqual(self.cursor.fetchall(), [("Apple", "ORG"), ("test", None)])
+
+
+class TestBatchFiles(unittest.TestCase):
+    """Class to test reading batches and their manifests, without a database"""
+    posts = [{"title": "first", "comments": []}, {"title": "second", "comments": []}]
+
+    def test_read_batch_round_trip(self):
+        """Posts written as gzipped JSON lines, or an older JSON list, should be read back"""
+        body = io.BytesIO()
+        with gzip.GzipFile(fileobj=body, mode='wb') as file:
+            for post in self.posts:
+                file.write((json.dumps(post) + "\n").encode('utf-8'))
+        body.seek(0)
+        self.assertEqual(list(read_batch(body, "batches/tech/1.jsonl.gz")), self.posts)
+        self.assertEqual(list(read_batch(io.BytesIO(json.dumps(self.posts).encode()),
+                                         "data.json")), self.posts)
+
+    def test_manifest_key(self):
+        """A batch should be announced by the manifest with the same id"""
+        self.assertEqual(manifest_key("batches/technology/20230522T120000Z-1a2b3c4d.jsonl.gz"),
+                         "manifests/technology/20230522T120000Z-1a2b3c4d.json")
+
+    def test_pending_batches_skips_loaded(self):
+        """Loaded batches should be left out, oldest first, and their manifests deleted"""
+        bucket = MagicMock()
+        manifests = []
+        for key in ["batches/b/2.jsonl.gz", "batches/a/3.jsonl.gz", "batches/a/1.jsonl.gz"]:
+            manifest = MagicMock()
+            manifest.get.return_value = {'Body': io.BytesIO(json.dumps({'key': key}).encode())}
+            manifests.append(manifest)
+        bucket.objects.filter.return_value = manifests
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [("batches/b/2.jsonl.gz",)]
+
+        self.assertEqual(pending_batches(bucket, cursor),
+                         ["batches/a/1.jsonl.gz", "batches/a/3.jsonl.gz"])
+        bucket.Object.assert_called_once_with("manifests/b/2.json")
+
+    def test_keys_to_load_includes_leftover_batches(self):
+        """A batch whose manifest outlived a failed load should be loaded with the event's keys"""
+        manifests = []
+        for key in ["batches/a/1.jsonl.gz", "batches/b/2.jsonl.gz"]:
+            manifest = MagicMock()
+            manifest.get.return_value = {'Body': io.BytesIO(json.dumps({'key': key}).encode())}
+            manifests.append(manifest)
+        bucket = MagicMock()
+        bucket.objects.filter.return_value = manifests
+        cursor = MagicMock()
+        cursor.fetchall.return_value = []
+
+        event = {'keys': ["batches/b/2.jsonl.gz"]}
+        self.assertEqual(keys_to_load(event, bucket, cursor),
+                         ["batches/a/1.jsonl.gz", "batches/b/2.jsonl.gz"])
+
 
 if __name__ == '__main__':
     unittest.main()
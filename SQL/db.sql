@@ -1,3 +1,6 @@
+DROP TABLE IF EXISTS Loaded_batch;
+DROP TABLE IF EXISTS Post_comment_daily;
+DROP TABLE IF EXISTS Keyword_sentiment_daily;
 DROP TABLE IF EXISTS Keyword_in_comment;
 DROP TABLE IF EXISTS Keyword_in_post;
 DROP TABLE IF EXISTS Post_keyword;
@@ -7,14 +10,17 @@ DROP TABLE IF EXISTS Post;
 
 CREATE TABLE IF NOT EXISTS Post (
     post_id INT GENERATED ALWAYS AS IDENTITY,
+    reddit_id VARCHAR(10),
     post_time TIMESTAMP NOT NULL,
     title varchar(300) NOT NULL,
+    content_hash UUID GENERATED ALWAYS AS (md5(title)::uuid) STORED,
     PRIMARY KEY (post_id)
 );
 
 CREATE TABLE IF NOT EXISTS Post_keyword (
     post_keyword_id INT GENERATED ALWAYS AS IDENTITY,
     post_keyword VARCHAR(50) NOT NULL UNIQUE,
+    label VARCHAR(20),
     PRIMARY KEY (post_keyword_id)
 );
 
@@ -33,6 +39,8 @@ CREATE TABLE IF NOT EXISTS Comment (
     score INT NOT NULL,
     sentiment FLOAT NOT NULL,
     post_id INT NOT NULL,
+    reddit_id VARCHAR(10),
+    content_hash UUID GENERATED ALWAYS AS (md5(comment)::uuid) STORED,
     FOREIGN KEY (post_id) REFERENCES Post(post_id),
     PRIMARY KEY (comment_id)
 );
@@ -50,3 +58,41 @@ CREATE TABLE IF NOT EXISTS Keyword_in_comment (
     FOREIGN KEY (comment_keyword_id) REFERENCES Comment_keyword(comment_keyword_id),
     UNIQUE (comment_id, comment_keyword_id)
 );
+
+CREATE TABLE IF NOT EXISTS Keyword_sentiment_daily (
+    day DATE NOT NULL,
+    post_keyword_id INT NOT NULL,
+    sentiment_sum FLOAT NOT NULL,
+    comment_count INT NOT NULL,
+    score_sum BIGINT NOT NULL,
+    FOREIGN KEY (post_keyword_id) REFERENCES Post_keyword(post_keyword_id),
+    PRIMARY KEY (day, post_keyword_id)
+);
+
+CREATE TABLE IF NOT EXISTS Post_comment_daily (
+    day DATE NOT NULL,
+    post_id INT NOT NULL,
+    comment_count INT NOT NULL,
+    FOREIGN KEY (post_id) REFERENCES Post(post_id),
+    PRIMARY KEY (day, post_id)
+);
+
+CREATE TABLE IF NOT EXISTS Loaded_batch (
+    batch_key VARCHAR(300) NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    new_posts INT,
+    new_comments INT,
+    PRIMARY KEY (batch_key)
+);
+
+-- Posts and comments are deduplicated on their Reddit id and on a hash of their text
+CREATE UNIQUE INDEX IF NOT EXISTS post_reddit_id_idx ON Post (reddit_id);
+CREATE UNIQUE INDEX IF NOT EXISTS post_content_hash_idx ON Post (content_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS comment_reddit_id_idx ON Comment (reddit_id);
+CREATE UNIQUE INDEX IF NOT EXISTS comment_content_hash_idx ON Comment (content_hash);
+
+-- Indexes for the dashboard's queries, which filter comments by time and join on keywords
+CREATE INDEX IF NOT EXISTS comment_time_idx ON Comment (comment_time);
+CREATE INDEX IF NOT EXISTS comment_post_id_idx ON Comment (post_id);
+CREATE INDEX IF NOT EXISTS keyword_in_post_keyword_idx ON Keyword_in_post (post_keyword_id);
+CREATE INDEX IF NOT EXISTS keyword_sentiment_daily_keyword_idx ON Keyword_sentiment_daily (post_keyword_id, day);
@@ -70,6 +70,36 @@ variable "bucket_name" {
   type = string
 }
 
+variable "subreddits" {
+  description = "Subreddits to extract in parallel, mapped to their number of posts. Defaults to subreddit_name with num_posts."
+  type = map(number)
+  default = {}
+}
+
+variable "max_concurrent_shards" {
+  description = "Maximum number of subreddits extracted and loaded at the same time."
+  type = number
+  default = 5
+}
+
+variable "reddit_requests_per_minute" {
+  description = "Reddit API request budget, shared between the shards extracted at the same time."
+  type = number
+  default = 60
+}
+
+variable "spacy_model" {
+  description = "Size of the spaCy model used for extraction (sm, md or lg)."
+  type = string
+  default = "lg"
+}
+
+variable "nlp_processes" {
+  description = "Number of processes analysing the extracted text, up to the vCPUs of the extract Lambda."
+  type = number
+  default = 2
+}
+
 variable "host" {
   description = "Database host."
   type = string
@@ -77,6 +107,14 @@ variable "host" {
 
 
 
+# Each subreddit is extracted and loaded by its own branch of the Step Function
+locals {
+  shards = length(var.subreddits) > 0 ? [
+    for name, posts in var.subreddits : { subreddit = name, num_posts = posts }
+  ] : [{ subreddit = var.subreddit_name, num_posts = tonumber(var.num_posts) }]
+}
+
+
 # Configure AWS provider
 provider "aws" {
   access_key = var.access_key
@@ -173,6 +211,9 @@ resource "aws_lambda_function" "sentiment-extract" {
       client_secret = var.client_secret
       subreddit_name = var.subreddit_name
       num_posts = var.num_posts
+      spacy_model = var.spacy_model
+      nlp_processes = var.nlp_processes
+      requests_per_minute = max(1, floor(var.reddit_requests_per_minute / min(var.max_concurrent_shards, length(local.shards))))
       bucket_name = var.bucket_name
       access_key = var.access_key
       secret_access_key = var.secret_key
@@ -348,16 +389,27 @@ resource "aws_sfn_state_machine" "sfn_state_machine" {
   definition = <<EOF
   {
     "Comment": "Invoke AWS Lambda from AWS Step Functions with Terraform",
-    "StartAt": "Extract",
+    "StartAt": "Shards",
     "States": {
-      "Extract": {
-        "Type": "Task",
-        "Resource": "${aws_lambda_function.sentiment-extract.arn}",
-        "Next": "Load"
-      },
-      "Load" : {
-        "Type": "Task",
-        "Resource": "${aws_lambda_function.sentiment-load.arn}",
+      "Shards": {
+        "Type": "Map",
+        "ItemsPath": "$.shards",
+        "MaxConcurrency": ${var.max_concurrent_shards},
+        "Iterator": {
+          "StartAt": "Extract",
+          "States": {
+            "Extract": {
+              "Type": "Task",
+              "Resource": "${aws_lambda_function.sentiment-extract.arn}",
+              "Next": "Load"
+            },
+            "Load" : {
+              "Type": "Task",
+              "Resource": "${aws_lambda_function.sentiment-load.arn}",
+              "End": true
+            }
+          }
+        },
         "End": true
       }
     }
@@ -386,6 +438,7 @@ resource "aws_cloudwatch_event_target" "schedule-target-sentiment" {
   rule = aws_cloudwatch_event_rule.sentiment-schedule-step-function.name
   arn  = aws_sfn_state_machine.sfn_state_machine.arn
   role_arn = aws_iam_role.sentiment-event-bridge-role.arn
+  input = jsonencode({ shards = local.shards })
 }
 
 